@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import glob
+import json
+import time
+from typing import List, Tuple, Dict, Iterator
+
+from cache import ConversionCache
+from naming import default_output_name
+
+SOURCE_EXTENSIONS = ('.3db', '.cmp')
+
+
+def is_batch_input(inputs: List[str]) -> bool:
+    return len(inputs) > 1 or any(os.path.isdir(x) or glob.has_magic(x) for x in inputs)
+
+
+def find_sources(inputs: List[str]) -> List[Tuple[str, str]]:
+    # (source path, path relative to the input it was found under) for every model file, the relative path is
+    # mirrored in the output directory
+    sources = []
+    seen = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, x) for x in sorted(filenames))
+        elif glob.has_magic(pattern):
+            # everything up to the first wildcard is the part that is not mirrored
+            parts = pattern.replace("\\", "/").split("/")
+            magic_index = min(i for i, part in enumerate(parts) if glob.has_magic(part))
+            root = "/".join(parts[:magic_index]) or ("/" if magic_index else ".")
+            paths = sorted(glob.glob(pattern, recursive=True))
+        else:
+            root = os.path.dirname(pattern)
+            paths = [pattern]
+
+        for path in paths:
+            if not os.path.isfile(path) or not path.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            key = os.path.abspath(path)
+            if key in seen:
+                continue
+            seen.add(key)
+            sources.append((path, os.path.relpath(path, root or ".")))
+    return sources
+
+
+def output_path(source: str, relative: str, output_dir: str = None, extension: str = "obj") -> str:
+    if output_dir:
+        return default_output_name(os.path.join(output_dir, relative), extension)
+    return default_output_name(source, extension)
+
+
+def conversion_settings(output_filename: str, scale: float, options: Dict = None) -> Dict:
+    # everything that changes the output of a conversion, in the form it takes after a JSON round trip
+    return json.loads(json.dumps({'output': os.path.abspath(output_filename), 'scale': scale, **(options or {})}))
+
+
+def run_jobs(func, tasks: List[Tuple], jobs: int = None, chunksize: int = 4) -> Iterator:
+    # func(*task) of every task in task order, on up to jobs worker processes, by default as many as there are CPUs.
+    # A single job or task runs in this process
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+    # multiprocessing is only loaded when there is something to run in parallel
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        yield from executor.map(func, *zip(*tasks), chunksize=chunksize)
+
+
+def convert_file(source: str, output_filename: str, scale: float, options: Dict = None) -> Dict:
+    from conversion import extract
+    result = {'source': source, 'output': output_filename, 'files': [], 'bytes': 0, 'error': None, 'skipped': False}
+    try:
+        output_dir = os.path.dirname(output_filename)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        result['files'] = extract(source, output_filename, scale, **(options or {}))
+        result['bytes'] = sum(os.path.getsize(x) for x in result['files'])
+    except Exception as ex:
+        result['error'] = f"{type(ex).__name__}: {ex}"
+    return result
+
+
+def convert_batch(inputs: List[str], output_dir: str = None, scale: float = 1, jobs: int = None,
+                  options: Dict = None, cache: ConversionCache = None, force: bool = False,
+                  extension: str = "obj") -> Dict:
+    sources = find_sources(inputs)
+    start = time.perf_counter()
+
+    tasks = []
+    skipped = []
+    for source, relative in sources:
+        output_filename = output_path(source, relative, output_dir, extension)
+        if cache and not force and cache.is_current(source, conversion_settings(output_filename, scale, options)):
+            skipped.append({'source': source, 'output': output_filename, 'files': [], 'bytes': 0, 'error': None,
+                            'skipped': True})
+        else:
+            tasks.append((source, output_filename, scale, options))
+
+    results = report_results(run_jobs(convert_file, tasks, jobs), len(tasks))
+
+    if cache:
+        for result in results:
+            if result['error']:
+                cache.invalidate(result['source'])
+            else:
+                cache.update(result['source'], conversion_settings(result['output'], scale, options), result['files'])
+        cache.save()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'files': len(results) + len(skipped),
+        'converted': sum(1 for x in results if not x['error']),
+        'skipped': len(skipped),
+        'failed': sum(1 for x in results if x['error']),
+        'bytes': sum(x['bytes'] for x in results),
+        'seconds': elapsed,
+        'results': skipped + results,
+    }
+    print(f"Converted {summary['converted']} of {summary['files']} files in {elapsed:.2f}s "
+          f"({summary['files'] / elapsed if elapsed else 0:.1f} files/s), {summary['bytes']} bytes written")
+    if skipped:
+        print(f"Skipped {len(skipped)} unchanged files")
+    for result in results:
+        if result['error']:
+            print(f"Failed: {result['source']}: {result['error']}")
+    return summary
+
+
+def report_results(results_iter, total: int) -> List[Dict]:
+    results = []
+    for i, result in enumerate(results_iter):
+        status = "failed" if result['error'] else "ok"
+        print(f"[{i + 1}/{total}] {result['source']} {status}")
+        results.append(result)
+    return results
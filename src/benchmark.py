@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from filereader3db import UtfFile
+from obj_generator import ObjModel
+from prisData import PartHierarchy, decode_part_records
+from synthetic import write_3db, write_cmp
+
+SAMPLES = ["tlancer.3db", "Tjumpgate.3db", "tdreadnought.cmp"]
+RESULTS_VERSION = 1
+
+
+def timed(phases: Dict[str, List[float]], phase: str, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    phases.setdefault(phase, []).append(time.perf_counter() - start)
+    return result
+
+
+def count_nodes(node: Dict) -> int:
+    return 1 + sum(count_nodes(v) for k, v in node.items() if k not in ('name', 'value', 'text'))
+
+
+def load_meshes(model_data: Dict, filename: str) -> List:
+    if filename.lower().endswith('.3db'):
+        meshes = [(os.path.basename(filename), model_data['\\']['openFLAME 3D N-mesh'])]
+    else:
+        meshes = [(k, v['openFLAME 3D N-mesh']) for k, v in model_data['\\'].items() if k.endswith('.3db')]
+    models = []
+    for k, mesh in meshes:
+        g = ObjModel()
+        g.load_mesh(mesh)
+        models.append((k, g))
+    return models
+
+
+def write_models(models: List, vertices: List[np.ndarray], output_dir: str) -> int:
+    # same files as ObjModel.write_files, with the vertices transformed beforehand so only writing is timed
+    written = 0
+    for (k, g), v in zip(models, vertices):
+        basename = k.split(".")[0]
+        obj_path = os.path.join(output_dir, basename + ".obj")
+        mtl_path = os.path.join(output_dir, basename + ".mtl")
+        with open(obj_path, "w") as outfile:
+            g.write_obj(outfile, basename, basename + ".mtl", v)
+        with open(mtl_path, "w") as outfile:
+            g.write_mtl(outfile)
+        written += os.path.getsize(obj_path) + os.path.getsize(mtl_path)
+    return written
+
+
+def run_once(filename: str, output_dir: str, scale: float, phases: Dict[str, List[float]]) -> Dict:
+    utf = UtfFile()
+    model_data = timed(phases, "utf_parse", utf.load_utf_file, filename, True)
+    hierarchy = None
+    if filename.lower().endswith('.cmp'):
+        parts, transforms = timed(phases, "part_decode", decode_part_records, model_data['\\']['Cmpnd']['Cons'])
+        hierarchy = timed(phases, "hierarchy", PartHierarchy, parts, ("Root",), transforms)
+    models = timed(phases, "mesh_load", load_meshes, model_data, filename)
+
+    def transform_all():
+        return [g.transformed_vertices(scale, hierarchy.file_transform(k) if hierarchy else None)
+                for k, g in models]
+
+    vertices = timed(phases, "vertex_transform", transform_all)
+    written = timed(phases, "obj_write", write_models, models, vertices, output_dir)
+    counts = {
+        "file_bytes": os.path.getsize(filename),
+        "nodes": count_nodes(model_data['\\']),
+        "parts": len(hierarchy.parts) if hierarchy else 0,
+        "meshes": len(models),
+        "vertices": sum(len(v) for v in vertices),
+        "face_groups": sum(len(g.face_groups) for _, g in models),
+        "triangles": sum(len(f.vertex_chain) // 3 for _, g in models for f in g.face_groups),
+        "bytes_written": written,
+    }
+    del model_data, models, vertices
+    utf.close()
+    return counts
+
+
+def run_case(filename: str, repeat: int, scale: float) -> Dict:
+    phases: Dict[str, List[float]] = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            counts = run_once(filename, output_dir, scale, phases)
+    return {
+        "file": filename,
+        "counts": counts,
+        "phases": {phase: {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+                   for phase, runs in phases.items()},
+    }
+
+
+def startup_times(repeat: int) -> Dict:
+    # wall time of fresh interpreters running the CLI, interpreter start and imports included
+    here = os.path.dirname(os.path.abspath(__file__))
+    extractor = os.path.join(here, "extractor.py")
+    commands = {"help": [extractor, "--help"]}
+    with tempfile.TemporaryDirectory() as output_dir:
+        sample = os.path.join(here, SAMPLES[0])
+        if os.path.exists(sample):
+            commands["convert_" + SAMPLES[0]] = [extractor, sample, "-o", os.path.join(output_dir, "startup.obj")]
+        startup = {}
+        for name, command in commands.items():
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, *command], stdout=subprocess.DEVNULL, check=True)
+                runs.append(time.perf_counter() - start)
+            startup[name] = {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+    return startup
+
+
+def synthetic_cases(directory: str, args) -> Dict[str, str]:
+    mesh_path = os.path.join(directory, "synthetic_mesh.3db")
+    print(f"Generating {mesh_path}")
+    write_3db(mesh_path, args.vertices, args.face_groups, args.materials)
+    cmp_path = os.path.join(directory, "synthetic_tree.cmp")
+    print(f"Generating {cmp_path}")
+    write_cmp(cmp_path, args.parts, args.depth, args.part_vertices, 4, args.materials)
+    return {"synthetic_mesh": mesh_path, "synthetic_tree": cmp_path}
+
+
+def compare(results: Dict, baseline: Dict):
+    for name, timing in results.get("startup", {}).items():
+        old = baseline.get("startup", {}).get(name)
+        if old and old["min"] > 0:
+            print(f"{'startup':<20} {name:<18} {old['min']:>10.4f}s -> {timing['min']:>10.4f}s "
+                  f"({timing['min'] / old['min']:.2f}x)")
+    for name, case in results["cases"].items():
+        if name not in baseline.get("cases", {}):
+            continue
+        for phase, timing in case["phases"].items():
+            old = baseline["cases"][name]["phases"].get(phase)
+            if old and old["min"] > 0:
+                print(f"{name:<20} {phase:<18} {old['min']:>10.4f}s -> {timing['min']:>10.4f}s "
+                      f"({timing['min'] / old['min']:.2f}x)")
+
+
+def benchmark_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="benchmark.py",
+                                     description="Time the conversion phases on the samples and synthetic models")
+    parser.add_argument("files", nargs="*", help=".3db/.cmp files to time, the bundled samples by default")
+    parser.add_argument("-o", dest="output", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per file, the minimum is reported")
+    parser.add_argument("-s", dest="scale", type=float, default=1)
+    parser.add_argument("--compare", metavar="FILE", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--startup", action="store_true",
+                        help="also time the command line start up, for --help and a small conversion")
+    parser.add_argument("--synthetic", action="store_true", help="also time generated models")
+    parser.add_argument("--vertices", type=int, default=1000000, help="vertices of the synthetic mesh")
+    parser.add_argument("--face-groups", type=int, default=2000, help="face groups of the synthetic mesh")
+    parser.add_argument("--materials", type=int, default=16, help="materials of the synthetic models")
+    parser.add_argument("--parts", type=int, default=1000, help="parts of the synthetic .cmp")
+    parser.add_argument("--depth", type=int, default=200, help="depth of the synthetic .cmp part tree")
+    parser.add_argument("--part-vertices", type=int, default=400, help="vertices of each synthetic .cmp part")
+    return parser
+
+
+def main(argv: List[str]) -> int:
+    args = benchmark_parser().parse_args(argv)
+    if args.files:
+        cases = {os.path.basename(f): f for f in args.files}
+    else:
+        here = os.path.dirname(os.path.abspath(__file__))
+        cases = {f: os.path.join(here, f) for f in SAMPLES if os.path.exists(os.path.join(here, f))}
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        if args.synthetic:
+            cases.update(synthetic_cases(synthetic_dir, args))
+            results["synthetic"] = {k: getattr(args, k) for k in
+                                    ("vertices", "face_groups", "materials", "parts", "depth", "part_vertices")}
+        for name, filename in cases.items():
+            case = run_case(filename, args.repeat, args.scale)
+            results["cases"][name] = case
+            timings = ", ".join(f"{phase} {timing['min']:.4f}s" for phase, timing in case["phases"].items())
+            print(f"{name}: {timings}")
+
+    if args.startup:
+        results["startup"] = startup_times(args.repeat)
+        for name, timing in results["startup"].items():
+            print(f"startup {name}: {timing['min']:.4f}s")
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(results, json.load(infile))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+from typing import Dict, List
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, mode="br") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ConversionCache:
+    # manifest of finished conversions, keyed by the absolute source path. An entry is current when the source
+    # content hash, the settings and the extractor version match and every output still has its recorded size and
+    # modification time.
+
+    def __init__(self, manifest_path: str, version: str):
+        self.manifest_path = manifest_path
+        self.version = version
+        self.entries: Dict[str, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path) as infile:
+                    data = json.load(infile)
+                if data.get('manifest_version') == MANIFEST_VERSION:
+                    self.entries = data['entries']
+            except (OSError, ValueError, KeyError):
+                print(f"Ignoring unreadable conversion cache {manifest_path}")
+
+    @staticmethod
+    def key(source: str) -> str:
+        return os.path.abspath(source)
+
+    def source_hash(self, source: str) -> str:
+        # the stored hash is reused while size and mtime of the source are unchanged
+        entry = self.entries.get(self.key(source))
+        stamp = file_stamp(source)
+        if entry and entry['source_stamp'] == stamp:
+            return entry['source_hash']
+        return file_hash(source)
+
+    def is_current(self, source: str, settings: Dict) -> bool:
+        entry = self.entries.get(self.key(source))
+        current = entry is not None \
+            and entry['version'] == self.version \
+            and entry['settings'] == settings \
+            and self.outputs_intact(entry) \
+            and entry['source_hash'] == self.source_hash(source)
+        if current:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return current
+
+    @staticmethod
+    def outputs_intact(entry: Dict) -> bool:
+        for path, stamp in entry['outputs'].items():
+            try:
+                if file_stamp(path) != stamp:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def update(self, source: str, settings: Dict, outputs: List[str]):
+        self.entries[self.key(source)] = {
+            'source_hash': self.source_hash(source),
+            'source_stamp': file_stamp(source),
+            'version': self.version,
+            'settings': settings,
+            'outputs': {os.path.abspath(x): file_stamp(x) for x in outputs},
+        }
+
+    def invalidate(self, source: str = None):
+        # drops one entry, or every entry if no source is given
+        if source is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(self.key(source), None)
+
+    def evict_stale(self) -> int:
+        # removes entries whose source is gone, that were written by another version or whose outputs were changed
+        stale = [source for source, entry in self.entries.items()
+                 if not os.path.isfile(source) or entry['version'] != self.version or not self.outputs_intact(entry)]
+        for source in stale:
+            del self.entries[source]
+        return len(stale)
+
+    def save(self):
+        manifest_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+        os.makedirs(manifest_dir, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump({'manifest_version': MANIFEST_VERSION, 'entries': self.entries}, outfile)
+        os.replace(temp_path, self.manifest_path)
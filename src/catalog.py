@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import time
+import sqlite3
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from filereader3db import UtfFile, get_as_float_array, get_as_int_list, get_as_string
+from obj_generator import transform_matrix, material_name, texture_maps
+from prisData import load_part_hierarchy
+from batch import find_sources, run_jobs
+from cache import file_stamp
+
+CATALOG_VERSION = 1
+BOUNDS_COLUMNS = "min_x REAL, min_y REAL, min_z REAL, max_x REAL, max_y REAL, max_z REAL"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS catalog (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, format TEXT,
+    nodes INTEGER, meshes INTEGER, parts INTEGER, vertices INTEGER, faces INTEGER, face_groups INTEGER,
+    {BOUNDS_COLUMNS}, error TEXT, inspected_at REAL);
+CREATE TABLE IF NOT EXISTS meshes (model TEXT, name TEXT, part TEXT, vertices INTEGER, faces INTEGER,
+    face_groups INTEGER, {BOUNDS_COLUMNS});
+CREATE TABLE IF NOT EXISTS materials (model TEXT, mesh TEXT, name TEXT, diffuse_map TEXT, bump_map TEXT);
+CREATE TABLE IF NOT EXISTS parts (model TEXT, name TEXT, parent TEXT);
+CREATE INDEX IF NOT EXISTS meshes_model ON meshes (model);
+CREATE INDEX IF NOT EXISTS materials_model ON materials (model);
+CREATE INDEX IF NOT EXISTS materials_diffuse_map ON materials (diffuse_map);
+CREATE INDEX IF NOT EXISTS parts_model ON parts (model);
+"""
+CHILD_TABLES = ("meshes", "materials", "parts")
+
+
+def node_children(index: Dict, folder: str) -> List[str]:
+    prefix = folder + "/"
+    return [x[len(prefix):] for x in index if x.startswith(prefix) and "/" not in x[len(prefix):]]
+
+
+def bounds(vertices: np.ndarray) -> List[float]:
+    if len(vertices) == 0:
+        return [None] * 6
+    return vertices.min(axis=0).tolist() + vertices.max(axis=0).tolist()
+
+
+def inspect_mesh(read, index: Dict, root: str, matrix: np.ndarray) -> Tuple[Dict, List[Dict], np.ndarray]:
+    # counts come from the node sizes, only the vertex list, the group count and the material names are read
+    vertices = get_as_float_array(read(f"{root}/Vertices/Object vertex list"), 3)
+    vertices = np.matmul(vertices, matrix[:3, :3].T) + matrix[:3, 3]
+    group_count = get_as_int_list(read(f"{root}/Face groups/Count"))[0]
+    faces = sum(index[f"{root}/Face groups/Group{i}/Face vertex chain"].size // 12 for i in range(group_count))
+    materials = []
+    library = f"{root}/Material library"
+    for name in node_children(index, library):
+        if name == "Material count":
+            continue
+        maps = None
+        map_path = f"{library}/{name}/Diffuse/Map/Name"
+        if map_path in index:
+            maps = texture_maps(get_as_string(read(map_path)))
+        materials.append({'name': material_name(name), 'diffuse_map': maps[0] if maps else None,
+                          'bump_map': maps[1] if maps else None})
+    mesh = {'vertices': len(vertices), 'faces': faces, 'face_groups': group_count, 'bounds': bounds(vertices)}
+    return mesh, materials, vertices
+
+
+def inspect_file(source: str) -> Dict:
+    path = os.path.abspath(source)
+    size, mtime_ns = file_stamp(source)
+    record = {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'format': source.lower().split(".")[-1],
+              'meshes': [], 'materials': [], 'parts': [], 'error': None}
+    try:
+        utf = UtfFile()
+        index = utf.open_index(source)
+        with open(source, "rb") as infile:
+            def read(node_path):
+                entry = index[node_path]
+                infile.seek(entry.offset)
+                return infile.read(entry.size)
+
+            # the index leaves out the root node
+            record['nodes'] = len(index) + 1
+            hierarchy = None
+            if record['format'] == "cmp":
+                cons = {key: {'value': read(f"Cmpnd/Cons/{key}")} for key in ('Pris', 'Rev')
+                        if f"Cmpnd/Cons/{key}" in index}
+                hierarchy = load_part_hierarchy(cons)
+                record['parts'] = [{'name': p.child_name, 'parent': p.parent_name} for p in hierarchy.parts]
+                roots = [(x, f"{x}/openFLAME 3D N-mesh") for x in index if "/" not in x and x.endswith(".3db")]
+            else:
+                roots = [(os.path.basename(source), "openFLAME 3D N-mesh")]
+
+            all_vertices = []
+            for name, root in roots:
+                part = hierarchy.part_for_file(name) if hierarchy is not None else None
+                matrix = transform_matrix(1, hierarchy.file_transform(name) if hierarchy is not None else None)
+                mesh, materials, vertices = inspect_mesh(read, index, root, matrix)
+                record['meshes'].append({'name': name, 'part': part.child_name if part else None, **mesh})
+                record['materials'] += [{'mesh': name, **mat} for mat in materials]
+                all_vertices.append(vertices)
+    except Exception as ex:
+        record['error'] = f"{type(ex).__name__}: {ex}"
+        return record
+
+    record['vertices'] = sum(x['vertices'] for x in record['meshes'])
+    record['faces'] = sum(x['faces'] for x in record['meshes'])
+    record['face_groups'] = sum(x['face_groups'] for x in record['meshes'])
+    record['bounds'] = bounds(np.concatenate(all_vertices)) if all_vertices else [None] * 6
+    return record
+
+
+class Catalog:
+    # SQLite index of inspected models, one row per model plus its meshes, materials and parts
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        version = None
+        try:
+            row = self.connection.execute("SELECT value FROM catalog WHERE key = 'version'").fetchone()
+            version = int(row[0]) if row else None
+        except sqlite3.DatabaseError:
+            pass
+        if version != CATALOG_VERSION:
+            # written by another version, rebuilt from scratch
+            for table in ("catalog", "models") + CHILD_TABLES:
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("INSERT OR REPLACE INTO catalog VALUES ('version', ?)", (str(CATALOG_VERSION),))
+
+    def stamps(self) -> Dict[str, Tuple[int, int]]:
+        return {path: (size, mtime_ns) for path, size, mtime_ns in
+                self.connection.execute("SELECT path, size, mtime_ns FROM models")}
+
+    def remove(self, path: str):
+        self.connection.execute("DELETE FROM models WHERE path = ?", (path,))
+        for table in CHILD_TABLES:
+            self.connection.execute(f"DELETE FROM {table} WHERE model = ?", (path,))
+
+    def add(self, record: Dict):
+        path = record['path']
+        self.remove(path)
+        if record['error']:
+            self.connection.execute("INSERT INTO models (path, size, mtime_ns, format, error, inspected_at) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", (path, record['size'], record['mtime_ns'],
+                                                                  record['format'], record['error'], time.time()))
+            return
+        self.connection.execute("INSERT INTO models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (path, record['size'], record['mtime_ns'], record['format'], record['nodes'],
+                                 len(record['meshes']), len(record['parts']), record['vertices'], record['faces'],
+                                 record['face_groups'], *record['bounds'], None, time.time()))
+        self.connection.executemany("INSERT INTO meshes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [(path, x['name'], x['part'], x['vertices'], x['faces'], x['face_groups'],
+                                      *x['bounds']) for x in record['meshes']])
+        self.connection.executemany("INSERT INTO materials VALUES (?, ?, ?, ?, ?)",
+                                    [(path, x['mesh'], x['name'], x['diffuse_map'], x['bump_map'])
+                                     for x in record['materials']])
+        self.connection.executemany("INSERT INTO parts VALUES (?, ?, ?)",
+                                    [(path, x['name'], x['parent']) for x in record['parts']])
+
+    def prune(self) -> int:
+        # drops the models whose file is gone
+        missing = [path for path in self.stamps() if not os.path.isfile(path)]
+        for path in missing:
+            self.remove(path)
+        return len(missing)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def inspect_batch(inputs: List[str], catalog_path: str, jobs: int = None, force: bool = False) -> Dict:
+    sources = [source for source, _ in find_sources(inputs)]
+    start = time.perf_counter()
+    catalog = Catalog(catalog_path)
+    stamps = catalog.stamps()
+    tasks = [x for x in sources if force or stamps.get(os.path.abspath(x)) != tuple(file_stamp(x))]
+
+    failed = 0
+    # the workers only read, every record is written here so the database has a single writer
+    for i, record in enumerate(run_jobs(inspect_file, [(x,) for x in tasks], jobs, chunksize=8)):
+        catalog.add(record)
+        if record['error']:
+            failed += 1
+            print(f"Failed: {record['path']}: {record['error']}")
+        if (i + 1) % 500 == 0:
+            catalog.connection.commit()
+            print(f"[{i + 1}/{len(tasks)}]")
+    pruned = catalog.prune()
+    catalog.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {'files': len(sources), 'inspected': len(tasks) - failed, 'unchanged': len(sources) - len(tasks),
+               'failed': failed, 'pruned': pruned, 'seconds': elapsed}
+    print(f"Inspected {summary['inspected']} of {summary['files']} files in {elapsed:.2f}s into {catalog_path}, "
+          f"{summary['unchanged']} unchanged, {failed} failed, {pruned} removed")
+    return summary
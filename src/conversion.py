@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import time
+from collections import deque
+from obj_generator import *
+from prisData import load_part_hierarchy
+from glb_generator import export_to_glb
+from npy_generator import export_to_npz, export_to_npy_dir
+from mesh_optimizer import optimize_model, format_report
+from mesh_simplifier import simplify_model, lod_target, triangle_count
+from mesh_validator import validate_model, format_issue
+from profiler import ProgressTracker, NO_PROFILER, bytes_written
+from naming import output_format_for
+
+# parts handed to the pool per worker ahead of the one being collected. Finished parts wait until the parts before
+# them are collected, this caps how many converted parts are held at once
+PARTS_IN_FLIGHT = 2
+
+# the source file opened by a process pool worker, see open_source
+source_tree = None
+
+
+def export_meshes(output_format, meshes, output_filename, filename, scale, hierarchy=None):
+    if output_format == "glb":
+        return export_to_glb(meshes, output_filename, scale, hierarchy)
+    if output_format == "npz":
+        return export_to_npz(meshes, output_filename, filename, scale, hierarchy)
+    return export_to_npy_dir(meshes, output_filename, filename, scale, hierarchy)
+
+
+def suffixed_name(output_filename, suffix):
+    # inserts the suffix in front of the extension, part_turret.obj -> part_turret_lod1.obj, a compression extension
+    # stays at the end, part.obj.gz -> part_lod1.obj.gz
+    output_filename, compression = split_compression(output_filename)
+    a = output_filename.split(".")
+    a[-2] += suffix
+    return ".".join(a) + compression
+
+
+def write_models(filename, output_format, loaded_parts, output_filename, scale, hierarchy=None, merge=False,
+                 profiler=NO_PROFILER, phase="write", precision=None):
+    # loaded_parts are (embedded file name, model) pairs, hierarchy is None for a single .3db
+    if hierarchy is not None and not merge and output_format == "obj":
+        written = []
+        for k, g in loaded_parts:
+            with profiler.phase(phase, k) as counts:
+                files = g.write_files(suffixed_name(output_filename, "_" + k.split(".")[0]), scale,
+                                      hierarchy.file_transform(k), precision)
+                counts['files'] = len(files)
+                counts['bytes_written'] = bytes_written(files)
+            written += files
+        return written
+
+    with profiler.phase(phase) as counts:
+        if output_format != "obj":
+            written = export_meshes(output_format, loaded_parts, output_filename, filename, scale, hierarchy)
+        elif hierarchy is None:
+            written = loaded_parts[0][1].write_files(output_filename, scale, precision=precision)
+        else:
+            merged_parts = [(k.split(".")[0], g, hierarchy.file_transform(k)) for k, g in loaded_parts]
+            written = export_merged_obj(merged_parts, output_filename, scale, precision)
+        counts['files'] = len(written)
+        counts['bytes_written'] = bytes_written(written)
+    return written
+
+
+def print_lod_level(level, ratio, summaries):
+    # summaries are the lod_* lists convert_part returns, one per part. Parts that stay above the target and parts
+    # that were not written because they could not be simplified any further are listed after the counts
+    index = level - 1
+    counts = ", ".join(f"{x['part']} {x['faces']} -> {x['lod_faces'][index]}" for x in summaries)
+    print(f"LOD {level} ({ratio:g}): {counts}")
+    for x in summaries:
+        if x['lod_faces'][index] > x['lod_targets'][index]:
+            print(f"Warning: LOD {level} of {x['part']} has {x['lod_faces'][index]} triangles, its target is "
+                  f"{x['lod_targets'][index]}")
+    skipped = [x['part'] for x in summaries if x['lod_skipped'][index]]
+    if skipped:
+        source = f"LOD {level - 1}" if level > 1 else "the full detail mesh"
+        print(f"Warning: LOD {level} of {', '.join(skipped)} is the same as {source} and was not written")
+
+
+def load_model(mesh, profiler, part, shared_materials=None) -> ObjModel:
+    with profiler.phase("mesh_load", part) as counts:
+        g = ObjModel()
+        g.load_mesh(mesh, shared_materials)
+        counts['vertices'] = len(g.vertices)
+        counts['face_groups'] = len(g.face_groups)
+        counts['faces'] = triangle_count(g)
+        counts['materials'] = len(g.materials)
+    return g
+
+
+def validate_parts(filename, loaded_parts, profiler=NO_PROFILER):
+    # runs before anything is written, a part with errors fails the whole file and warnings are only printed
+    errors = []
+    for k, g in loaded_parts:
+        with profiler.phase("validate", k) as counts:
+            report = validate_model(g)
+            counts['errors'] = len(report['errors'])
+            counts['warnings'] = len(report['warnings'])
+        for found in report['warnings']:
+            print(f"Warning: {format_issue(k, found)}")
+        errors += [format_issue(k, found) for found in report['errors']]
+    if errors:
+        raise ValueError(f"{filename} is not a valid model: " + "; ".join(errors))
+
+
+def open_source(filename):
+    # process pool initializer, every worker maps and parses the file once and takes its parts from there
+    global source_tree
+    source_tree = UtfFile().load_utf_file(filename, use_mmap=True)
+
+
+def convert_part(mesh, k, output_filename, scale, translation_matrix, optimize=False, lods=None,
+                 precision=None) -> Dict:
+    # loads, optimizes and writes one part of a .cmp to its own OBJ/MTL, then simplifies and writes its LOD levels,
+    # each from the one before it. Runs on a pool worker, the reports are returned and printed in part order by
+    # convert_parts
+    start = time.perf_counter()
+    g = ObjModel()
+    g.load_mesh(mesh)
+    result = {'part': k, 'vertices': len(g.vertices), 'face_groups': len(g.face_groups), 'report': None}
+    if optimize:
+        result['report'] = format_report(k, optimize_model(g))
+    result['faces'] = triangle_count(g)
+    suffix = "_" + k.split(".")[0]
+    result['files'] = [g.write_files(suffixed_name(output_filename, suffix), scale, translation_matrix, precision)]
+    result.update({'lod_faces': [], 'lod_targets': [], 'lod_skipped': []})
+    previous = g
+    for level, ratio in enumerate(lods or [], start=1):
+        result['lod_targets'].append(lod_target(result['faces'], ratio))
+        lod = simplify_model(previous, result['lod_targets'][-1])
+        result['lod_faces'].append(triangle_count(lod))
+        result['lod_skipped'].append(lod is previous)
+        lod_filename = suffixed_name(suffixed_name(output_filename, f"_lod{level}"), suffix)
+        result['files'].append([] if lod is previous else
+                               lod.write_files(lod_filename, scale, translation_matrix, precision))
+        previous = lod
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def convert_source_part(k, *args) -> Dict:
+    # process pool task, the mesh comes from the file the worker opened
+    return convert_part(source_tree['\\'][k]['openFLAME 3D N-mesh'], k, *args)
+
+
+def convert_parts(filename, parts, output_filename, scale, hierarchy, optimize=False, lods=None, precision=None,
+                  profiler=NO_PROFILER, jobs=2, pool="process") -> List[str]:
+    # the parts of a .cmp written to an OBJ/MTL each are independent, they are converted on jobs threads or processes.
+    # Results are collected in part order so the files, the printed reports and the returned list are the same as in a
+    # sequential conversion
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    if pool == "process":
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=open_source, initargs=(filename,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+
+    def submit(k, mesh):
+        args = (output_filename, scale, hierarchy.file_transform(k), optimize, lods, precision)
+        if pool == "process":
+            return executor.submit(convert_source_part, k, *args)
+        return executor.submit(convert_part, mesh, k, *args)
+
+    def collect(future):
+        result = future.result()
+        with profiler.phase("convert", result['part']) as counts:
+            counts.update({key: result[key] for key in ('vertices', 'face_groups', 'faces')})
+            counts['worker_seconds'] = result['seconds']
+            counts['files'] = sum(len(files) for files in result['files'])
+            counts['bytes_written'] = sum(bytes_written(files) for files in result['files'])
+        results.append(result)
+
+    results = []
+    pending = deque()
+    try:
+        for k, mesh in parts:
+            pending.append(submit(k, mesh))
+            if len(pending) >= jobs * PARTS_IN_FLIGHT:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    finally:
+        # an error or a cancelled conversion drops the parts that did not start yet
+        executor.shutdown(cancel_futures=True)
+
+    for result in results:
+        if result['report']:
+            print(result['report'])
+    for level, ratio in enumerate(lods or [], start=1):
+        print_lod_level(level, ratio, results)
+    return [path for level in range(1 + len(lods or [])) for x in results for path in x['files'][level]]
+
+
+def conversion_steps(part_count, compound, output_format, merge=False, optimize=False, lods=None,
+                     validate=True, concurrent=False) -> int:
+    # number of phases extract() goes through, parse, hierarchy, load, validate, optimize, write and the LOD levels.
+    # compound is True for a .cmp, concurrent parts only go through validate and the convert phase of their worker
+    if concurrent:
+        return 2 + part_count * (1 + validate)
+    writes = part_count if compound and not merge and output_format == "obj" else 1
+    lod_count = len(lods or [])
+    return 1 + compound + part_count * (1 + validate + optimize + lod_count) + writes * (1 + lod_count)
+
+
+def extract(filename, output_filename, scale, merge=False, optimize=False, lods=None, profiler=None, progress=None,
+            precision=None, part_jobs=None, part_pool="process", validate=True):
+    # profiler is an optional profiler.Profiler that records the phases of this conversion, progress is called with
+    # (done, total, description) before every phase and can raise to abort the conversion. precision is the number of
+    # decimals of the OBJ/MTL numbers, None keeps the six decimal default. With part_jobs above 1 the parts of a .cmp
+    # written to separate OBJs are converted concurrently on a "process" or "thread" pool. validate checks the indices
+    # and coordinates of every mesh before the first file is written
+    profiler = profiler or NO_PROFILER
+    if progress:
+        profiler = ProgressTracker(progress, profiler)
+    a = UtfFile()
+    with profiler.phase("utf_parse") as counts:
+        model_data = a.load_utf_file(filename, use_mmap=True)
+        counts['bytes_read'] = len(a.mapped)
+        counts['nodes'] = a.read_header(a.mapped).node_size // NODE_STRUCT.size
+    output_format = output_format_for(output_filename)
+    hierarchy = None
+    loaded_parts = []
+    compound = filename.lower().endswith('.cmp')
+    concurrent = compound and part_jobs and part_jobs > 1 and not merge and output_format == "obj"
+    if progress:
+        # the total is known before the first part loads, so the reported fraction only ever goes up
+        part_count = sum(k.endswith('.3db') for k in model_data['\\']) if compound else 1
+        profiler.total = conversion_steps(part_count, compound, output_format, merge, optimize, lods, validate,
+                                          bool(concurrent))
+    if filename.lower().endswith('.3db'):
+        part = os.path.basename(filename)
+        loaded_parts.append((part, load_model(model_data['\\']['openFLAME 3D N-mesh'], profiler, part)))
+    elif filename.lower().endswith('.cmp'):
+        with profiler.phase("hierarchy") as counts:
+            hierarchy = load_part_hierarchy(model_data['\\']['Cmpnd']['Cons'])
+            counts['parts'] = len(hierarchy.parts)
+        if hierarchy.missing_parents:
+            print(f"Missing parent parts: {', '.join(hierarchy.missing_parents)}")
+        if concurrent:
+            parts = [(k, v['openFLAME 3D N-mesh']) for k, v in model_data['\\'].items() if k.endswith('.3db')]
+            if validate:
+                # decoding only wraps the mapped data, the workers decode their part again
+                validate_parts(filename, [(k, load_model(mesh, NO_PROFILER, k)) for k, mesh in parts], profiler)
+            written = convert_parts(filename, parts, output_filename, scale, hierarchy, optimize, lods, precision,
+                                    profiler, part_jobs, part_pool)
+            if progress:
+                profiler.finish()
+            return written
+        # materials are only shared when all parts end up in the same file
+        shared_materials = {} if merge or output_format != "obj" else None
+        for k, v in model_data['\\'].items():
+            if k.endswith('.3db'):
+                loaded_parts.append((k, load_model(v['openFLAME 3D N-mesh'], profiler, k, shared_materials)))
+    else:
+        return []
+
+    if validate:
+        validate_parts(filename, loaded_parts, profiler)
+
+    if optimize:
+        for k, g in loaded_parts:
+            with profiler.phase("optimize", k):
+                print(format_report(k, optimize_model(g)))
+
+    written = write_models(filename, output_format, loaded_parts, output_filename, scale, hierarchy, merge, profiler,
+                           precision=precision)
+
+    # each level is simplified from the level before it and written next to the full detail output. A part that can
+    # not be simplified any further is not written again, in a merged or single output file only when no part changed
+    separate_files = hierarchy is not None and not merge and output_format == "obj"
+    summaries = [{'part': k, 'faces': triangle_count(g), 'lod_faces': [], 'lod_targets': [], 'lod_skipped': []}
+                 for k, g in loaded_parts]
+    previous_parts = loaded_parts
+    for level, ratio in enumerate(lods or [], start=1):
+        lod_parts = []
+        for (k, g), summary in zip(previous_parts, summaries):
+            with profiler.phase(f"lod{level}_simplify", k) as counts:
+                summary['lod_targets'].append(lod_target(summary['faces'], ratio))
+                lod_parts.append((k, simplify_model(g, summary['lod_targets'][-1])))
+                summary['lod_faces'].append(triangle_count(lod_parts[-1][1]))
+                counts['faces'] = summary['lod_faces'][-1]
+        changed = [lod is not g for (_, g), (_, lod) in zip(previous_parts, lod_parts)]
+        if not separate_files:
+            changed = [any(changed)] * len(changed)
+        for summary, written_part in zip(summaries, changed):
+            summary['lod_skipped'].append(not written_part)
+        print_lod_level(level, ratio, summaries)
+        if any(changed):
+            written += write_models(filename, output_format,
+                                    [part for part, written_part in zip(lod_parts, changed) if written_part],
+                                    suffixed_name(output_filename, f"_lod{level}"), scale, hierarchy, merge, profiler,
+                                    f"lod{level}_write", precision)
+        previous_parts = lod_parts
+    if progress:
+        profiler.finish()
+    return written
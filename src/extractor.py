@@ -1,227 +1,244 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import os
 import sys
-from tkinter import *
-from tkinter import filedialog, messagebox
-from obj_generator import *
-from prisData import CmpPartData, Part
+import argparse
+from typing import List
+from filereader3db import UtfFile
+from naming import COMPRESSION_EXTENSIONS, is_compressed, compressed_output, output_format_for, default_output_name
 
 VERSION = "0.2.1"
 
-class Gui:
 
-    def __init__(self):
-        self.filename = ""
-        self.output_filename = ""
-        self.scale = 1
-
-    def open_input_file(self):
-        filename = filedialog.askopenfile(initialdir=f"{os.getcwd()}", title="Select file",
-                               filetypes=(("all files", "*.*"), ("3db files", "*.3db"), ("cmp files", "*.cmp") ))
-        if filename:
-            self.filename = filename
-            self.v_input_name.set(self.filename.name)
-            self.v_output_name.set(default_output_name(self.filename.name))
-            self.v_material_name.set(default_material_name(self.filename.name))
-
-    def open_output_file(self):
-        output_filename: str = filedialog.asksaveasfilename(initialdir=f"{os.path.dirname(self.v_output_name.get())}", title="Select file",
-                                     filetypes=(("Wavefront OBJ", "*.obj"), ("all files", "*.*")))
-        if output_filename:
-            self.output_filename = output_filename
-            if not self.output_filename.endswith(".obj"):
-                self.output_filename += ".obj"
-
-            if self.output_filename:
-                self.v_output_name.set(self.output_filename)
-                self.v_material_name.set(self.output_filename.replace("obj", "mtl"))
-
-    def load_gui(self):
-        self.window = Tk()
-        window = self.window
-        window.resizable(False, False)
-        window.title(f"Extractor {VERSION}")
-        title_label = Label(window, text="Conquest: Frontier Wars model extractor", font=("Arial Bold", 16))
-        title_label.grid(column=0, row=0)
-
-
-        #input
-        input_frame = LabelFrame(window, text="Input", padx=5, pady=5)
-
-        input_label = Label(input_frame, text="Input file:", padx=10, pady=10)
-        input_label.grid(column=0, row=0)
-
-        self.v_input_name = StringVar()
-        input_name_entry = Entry(input_frame, textvariable=self.v_input_name, width=80, state="readonly")
-        input_name_entry.grid(column=1, row=0)
-
-        input_button = Button(input_frame, text="Browse", command=self.open_input_file)
-        input_button.grid(column=2, row=0)
-
-        input_frame.grid(column=0,row=1)
-
-
-        #output
-        output_frame = LabelFrame(window, text="Output", padx=5, pady=5)
-
-        output_label = Label(output_frame, text="Scale:", padx=10, pady=10)
-        output_label.grid(column=0, row=0)
-
-        self.v_scale = StringVar()
-        self.v_scale.set("1")
-        output_name_entry = Entry(output_frame, textvariable=self.v_scale, width=80)
-        output_name_entry.grid(column=1, row=0)
-
-        output_label = Label(output_frame, text="Output file:", padx=10, pady=10)
-        output_label.grid(column=0, row=1)
-
-        self.v_output_name = StringVar()
-        output_name_entry = Entry(output_frame, textvariable=self.v_output_name, width=80, state="readonly")
-        output_name_entry.grid(column=1, row=1)
-
-        output_button = Button(output_frame, text="Browse", command=self.open_output_file)
-        output_button.grid(column=2, row=1)
-
-        output_frame.grid(column=0, row=2)
-
-        material_label = Label(output_frame, text="Material file:", padx=10, pady=10)
-        material_label.grid(column=0, row=2)
-
-        self.v_material_name = StringVar()
-        output_name_entry = Entry(output_frame, textvariable=self.v_material_name, width=80, state="readonly")
-        output_name_entry.grid(column=1, row=2)
-
-        extract_button = Button(window, text="Extract", command=self.extract)
-        extract_button.grid(column=0, row=3)
-
-        window.grid_columnconfigure(0, weight=1)
-        window.grid_rowconfigure(0, weight=1)
-
-        window.mainloop()
-
-    def extract(self):
+def __getattr__(name):
+    # extract() and the export helpers live in conversion, which is only imported with numpy when first used
+    import conversion
+    try:
+        return getattr(conversion, name)
+    except AttributeError:
+        raise AttributeError(f"module 'extractor' has no attribute '{name}'") from None
+
+
+def list_nodes(filename, index_path=None):
+    utf = UtfFile()
+    index = utf.open_index(filename, index_path)
+    for node_path in utf.iter_paths():
+        entry = index[node_path]
+        print(f"{entry.flags:#06x} {entry.size:>10} {node_path}")
+
+
+def dump_node(filename, node_path, output_filename=None, index_path=None):
+    utf = UtfFile()
+    utf.open_index(filename, index_path)
+    try:
+        data = utf.get(node_path)
+    except KeyError:
+        print(f"Node not found: {node_path}")
+        exit(1)
+    if output_filename:
+        with open(output_filename, "wb") as outfile:
+            outfile.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+
+
+def node_command_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="extractor.py", description="Inspect the node tree or contents of .3db and .cmp files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_help = "node index cache, created if missing or outdated"
+
+    list_parser = commands.add_parser("list", help="list all node paths with flags and size")
+    list_parser.add_argument("file")
+    list_parser.add_argument("-i", dest="index", metavar="FILE", help=index_help)
+
+    dump_parser = commands.add_parser("dump", help="write the raw data of a node")
+    dump_parser.add_argument("file")
+    dump_parser.add_argument("node", help="slash separated node path, e.g. Cmpnd/Cons/Pris")
+    dump_parser.add_argument("-o", dest="output", metavar="FILE", help="output file, standard output if not given")
+    dump_parser.add_argument("-i", dest="index", metavar="FILE", help=index_help)
+
+    inspect_parser = commands.add_parser("inspect", help="collect counts, bounds, materials and parts of models "
+                                                          "into a SQLite catalog")
+    inspect_parser.add_argument("inputs", nargs="+", metavar="path", help=".3db/.cmp files, directories or globs")
+    inspect_parser.add_argument("-o", dest="output", metavar="FILE", default="catalog.sqlite",
+                                help="catalog file, unchanged models already in it are skipped")
+    inspect_parser.add_argument("-j", "--jobs", type=int, default=None,
+                                help="worker processes, defaults to the number of CPUs")
+    inspect_parser.add_argument("--force", action="store_true", help="inspect unchanged models again")
+
+    validate_parser = commands.add_parser("validate", help="check the indices and coordinates of models without "
+                                                            "converting them")
+    validate_parser.add_argument("inputs", nargs="+", metavar="path", help=".3db/.cmp files, directories or globs")
+    validate_parser.add_argument("-o", dest="output", metavar="FILE", help="write the report as JSON")
+    validate_parser.add_argument("-j", "--jobs", type=int, default=None,
+                                 help="worker processes, defaults to the number of CPUs")
+    return parser
+
+
+def lod_ratios(value: str) -> List[float]:
+    ratios = [float(x) for x in value.split(",") if x.strip()]
+    if not all(0 < x < 1 for x in ratios):
+        raise argparse.ArgumentTypeError("LOD ratios have to be between 0 and 1")
+    return ratios
+
+
+def precision_digits(value: str) -> int:
+    digits = int(value)
+    if not 0 <= digits <= 17:
+        raise argparse.ArgumentTypeError("precision has to be between 0 and 17 decimals")
+    return digits
+
+
+def extract_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="extractor.py", description=f"Conquest: Frontier Wars model extractor {VERSION}",
+        epilog="Node commands: extractor.py list|dump|inspect|validate ... (see extractor.py list -h). "
+               "Without arguments the GUI is started.")
+    parser.add_argument("inputs", nargs="+", metavar="path",
+                        help=".3db or .cmp file; directories and glob patterns convert every model under them")
+    parser.add_argument("-o", dest="output", metavar="PATH",
+                        help="output file name, or the output directory when converting several files. "
+                             "The extension selects the format: .obj (default), .glb, .npz or .npy")
+    parser.add_argument("-s", dest="scale", type=float, default=1, help="scale of the model")
+    parser.add_argument("-f", "--format", choices=("obj", "glb", "npz", "npy"),
+                        help="output format if no output file name is given, otherwise the extension decides")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes for batch conversion, defaults to the number of CPUs. For a single "
+                             ".cmp the number of parts converted at the same time, one after the other by default")
+    parser.add_argument("--pool", choices=("process", "thread"), default="process",
+                        help="run the parts of a single .cmp on worker processes or threads")
+    parser.add_argument("--merge", action="store_true",
+                        help="write all parts of a .cmp into one OBJ and MTL instead of one pair per part")
+    parser.add_argument("--optimize", action="store_true",
+                        help="weld identical vertices, drop unused ones and reorder triangles for the vertex cache. "
+                             "The reordering takes about 2 s per 100k triangles, meshes above 250k triangles are "
+                             "only welded")
+    parser.add_argument("--precision", type=precision_digits, metavar="N",
+                        help="decimals of the OBJ coordinates and MTL colours, trailing zeros are dropped. "
+                             "By default every number has six decimals")
+    parser.add_argument("--compress", choices=tuple(COMPRESSION_EXTENSIONS),
+                        help="write the OBJ compressed, adding .gz or .zst to its name. An output name ending in .gz "
+                             "or .zst is always compressed. zstd needs the zstandard package")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="write the models without checking their indices and coordinates first")
+    parser.add_argument("--lod", type=lod_ratios, default=[], metavar="RATIOS",
+                        help="comma separated triangle ratios of additional detail levels, e.g. 0.5,0.25,0.1")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="conversion manifest, unchanged inputs with intact outputs are skipped")
+    parser.add_argument("--force", action="store_true", help="convert even if the cache says the output is current")
+    parser.add_argument("--prune-cache", action="store_true",
+                        help="remove cache entries of deleted sources, changed outputs and older versions")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write the time, peak memory and counts of every conversion phase as JSON")
+    parser.add_argument("--textures", action="append", metavar="DIR",
+                        help="directory to search for the textures of the models, they are copied next to the "
+                             "outputs. Can be given several times, the first directory with a texture wins")
+    parser.add_argument("--link-textures", action="store_true",
+                        help="hard link the textures instead of copying them where possible")
+    parser.add_argument("--png", action="store_true", help="also write the textures as PNG, needs Pillow")
+    parser.add_argument("--version", action="version", version=VERSION)
+    return parser
+
+
+def main(argv: List[str]):
+    if argv and argv[0] in ("list", "dump", "inspect", "validate"):
+        args = node_command_parser().parse_args(argv)
+        if args.command == "list":
+            list_nodes(args.file, args.index)
+        elif args.command == "inspect":
+            from catalog import inspect_batch
+            summary = inspect_batch(args.inputs, args.output, args.jobs, args.force)
+            return 1 if summary['failed'] else 0
+        elif args.command == "validate":
+            from mesh_validator import validate_batch
+            summary = validate_batch(args.inputs, args.output, args.jobs)
+            return 1 if summary['invalid'] else 0
+        else:
+            dump_node(args.file, args.node, args.output, args.index)
+        return 0
+
+    parser = extract_parser()
+    args = parser.parse_args(argv)
+    # the conversion modules and numpy are imported only once the arguments are known to be valid
+    from contextlib import nullcontext
+    from batch import is_batch_input, convert_batch, conversion_settings
+    from cache import ConversionCache
+    from profiler import Profiler
+    from conversion import extract
+
+    if args.compress == "zstd" or (args.output or "").lower().endswith(".zst"):
         try:
-            scale = float(self.v_scale.get())
-            extract(self.v_input_name.get(), self.v_output_name.get(), scale)
-            messagebox.showinfo("Success", "Object extracted")
-        except Exception as ex:
-            print(ex)
-            messagebox.showerror("Error", ex)
-
-def default_output_name(filename):
-    temp = filename.split(".")
-    temp[-1] = "obj"
-    return ".".join(temp)
-
-
-def default_material_name(filename):
-    temp = filename.split(".")
-    temp[-1] = "mtl"
-    return ".".join(temp)
-
-def print_help():
-    print(f"Extractor Version: {VERSION}")
-    print("Usage:")
-    print("python extractor.py path/to/file [options]")
-    print("Options:")
-    print("    -o <file>                           Output file name")
-    print("    -s <floating point value>           Scale of the model")
-    exit(1)
-
-
-def get_parent_trans(all_data: List[Part], part: Part):
-    parent_part = [x for x in all_data if x.child_name == part.parent_name]
-    if parent_part:
-        this_part = parent_part[0]
-        this_trasnform = this_part.trans_mat()
-        parent_tansform = get_parent_trans(all_data, this_part)
-        return np.matmul(this_trasnform, parent_tansform)
+            import zstandard
+        except ImportError:
+            parser.error("zstd output needs the zstandard package (pip install zstandard)")
+
+    options = {'merge': args.merge, 'optimize': args.optimize, 'lods': args.lod}
+    if args.precision is not None:
+        # only set when given, so cache entries of default precision conversions stay valid
+        options['precision'] = args.precision
+    if not args.validate:
+        options['validate'] = False
+    cache = ConversionCache(args.cache, VERSION) if args.cache else None
+    if cache and args.prune_cache:
+        print(f"Removed {cache.evict_stale()} stale cache entries")
+
+    if is_batch_input(args.inputs):
+        if args.profile:
+            parser.error("--profile needs a single input file")
+        extension = args.format or "obj"
+        if args.compress:
+            if extension != "obj":
+                parser.error("only OBJ output can be compressed")
+            extension = compressed_output(extension, args.compress)
+        summary = convert_batch(args.inputs, args.output, args.scale, args.jobs, options, cache, args.force, extension)
+        if args.textures:
+            models = [(x['source'], os.path.dirname(x['output'])) for x in summary['results'] if not x['error']]
+            place_textures(args, models)
+        return 1 if summary['failed'] else 0
+
+    filename = args.inputs[0]
+    output_filename = args.output or default_output_name(filename, args.format or "obj")
+    if args.compress:
+        output_filename = compressed_output(output_filename, args.compress)
+    if is_compressed(output_filename) and output_format_for(output_filename) != "obj":
+        parser.error("only OBJ output can be compressed")
+    settings = conversion_settings(output_filename, args.scale, options)
+    if cache and not args.force and not args.profile and cache.is_current(filename, settings):
+        print("Up to date")
     else:
-        return np.identity(4)
-
-def extract(filename, output_filename, scale):
-    a = UtfFile()
-    model_data = a.load_utf_file(filename)
-    if filename.endswith('.3db'):
-        g = ObjModel()
-        g.export_to_obj(model_data['\\']['openFLAME 3D N-mesh'], output_filename, scale)
-    elif filename.endswith('.cmp'):
-        already_calculated_values = {}
-        basename = output_filename
-        v = model_data['\\']['Cmpnd']
-        all_data: List[Part] = []
-        if 'Pris' in v['Cons']:
-            prisData = CmpPartData(v['Cons']['Pris'])
-            all_data.extend(prisData.parts)
-        # print(prisData.parts)
-        if 'Rev' in v['Cons']:
-            revData = CmpPartData(v['Cons']['Rev'])
-            all_data.extend(revData.parts)
-        # print(revData.parts)
-        for k, v in model_data['\\'].items():
-            if k.endswith('.3db'):
-                a = basename.split(".")
-                a[-2] += "_" + k.split(".")[0]
-                output_filename = ".".join(a)
-                g = ObjModel()
-                pos_data: List[Part] = [x for x in all_data if k.startswith(x.child_name)]
-                local_transform = np.identity(4)
-                if pos_data:
-                    pos_data_t: Part = pos_data[0]
-                    parent_transform = get_parent_trans(all_data, pos_data_t)
-                    child_transform = pos_data_t.trans_mat()
-                    local_transform = np.matmul(child_transform, parent_transform)
-                g.export_to_obj(v['openFLAME 3D N-mesh'], output_filename, scale, local_transform)
-    print("Done")
+        profiler = Profiler() if args.profile else None
+        try:
+            with profiler or nullcontext():
+                written = extract(filename, output_filename, args.scale, profiler=profiler, part_jobs=args.jobs,
+                                  part_pool=args.pool, **options)
+        except ValueError as ex:
+            # an invalid model or option, the message is enough without a traceback
+            print(ex, file=sys.stderr)
+            return 1
+        if profiler:
+            profiler.save(args.profile, file=filename, output=output_filename, version=VERSION, settings=settings)
+        if cache:
+            cache.update(filename, settings, written)
+        print("Done")
+    if cache:
+        cache.save()
+    if args.textures:
+        place_textures(args, [(filename, os.path.dirname(output_filename))])
+    return 0
+
+
+def place_textures(args, models):
+    from textures import collect_textures
+    collect_textures(models, args.textures, args.link_textures, args.png)
 
 
 if __name__ == '__main__':
-
-    scale = 1
-    output_filename = ""
-
-    if len(sys.argv) > 6:
-        print("Invalid number of arguments!")
-        print_help()
-    elif len(sys.argv) == 1:
+    # a frozen executable starts its pool workers through this script, they have to stop here
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if len(sys.argv) == 1:
+        from gui import Gui
         gui = Gui()
         gui.load_gui()
-    elif len(sys.argv) == 2:
-        output_filename = default_output_name(sys.argv[1])
-    elif len(sys.argv) == 4:
-        options = {sys.argv[2][1:]: sys.argv[3]}
-        if "o" in options.keys():
-            output_filename = options["o"]
-        elif "s" in options.keys():
-            try:
-                scale = float(options["s"])
-            except:
-                print(f"Invalid scale value: {options['s']}")
-                print_help()
-            output_filename = default_output_name(sys.argv[1])
-        else:
-            print("Invalid parameter!")
-            print_help()
-    elif len(sys.argv) == 6:
-        options = {sys.argv[2][1:]: sys.argv[3], sys.argv[4][1:]: sys.argv[5]}
-        if "o" in options.keys():
-            output_filename = options["o"]
-        else:
-            print("Invalid parameter!")
-            print_help()
-        if "s" in options.keys():
-            try:
-                scale = float(options["s"])
-            except:
-                print(f"Invalid scale value: {options['s']}")
-                print_help()
-        else:
-            print("Invalid parameter!")
-            print_help()
-
-    if len(sys.argv) != 1:
-        filename = sys.argv[1]
-        extract(filename, output_filename, scale)
-
-
-
+    else:
+        exit(main(sys.argv[1:]))
@@ -1,26 +1,46 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import os
 import sys
+import mmap
+import json
 import struct
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple, NamedTuple
+
+
+def _as_array(data, dtype: str, columns: int = None):
+    # numpy is only loaded once a value is decoded, reading and indexing the node tree does not need it
+    import numpy as np
+    dtype = np.dtype(dtype)
+    if len(data) % dtype.itemsize:
+        raise ValueError(f"Buffer length {len(data)} is not a multiple of {dtype.itemsize}")
+    # frombuffer shares memory with the node value, no copy is made
+    arr = np.frombuffer(data, dtype=dtype)
+    if columns:
+        if len(arr) % columns:
+            raise ValueError(f"{len(arr)} values can not be split into rows of {columns}")
+        arr = arr.reshape(-1, columns)
+    return arr
+
+
+def get_as_int_array(data, columns: int = None, signed: bool = False):
+    return _as_array(data, "<i4" if signed else "<u4", columns)
+
+
+def get_as_float_array(data, columns: int = None):
+    return _as_array(data, "<f4", columns)
 
 
 def get_as_int_list(data: bytearray) -> List[int]:
-    arr = []
-    for i in range(0, len(data), 4):
-        arr.append(int.from_bytes(data[i:i+4], sys.byteorder, signed=False))
-    return arr
+    return get_as_int_array(data).tolist()
 
 
 def get_as_float_list(data: bytearray) -> List[float]:
-    arr = []
-    for i in range(0, len(data), 4):
-        arr.append(struct.unpack("f", data[i:i+4])[0])
-    return arr
+    return get_as_float_array(data).tolist()
 
 
 def get_as_string(data: bytearray):
-    return data.decode("ASCII")
+    return bytes(data).decode("ASCII")
 
 
 def get_int(data: bytes, pos: int) -> (int, int):
@@ -37,90 +57,220 @@ def get_string(data:bytes, start_index: int, max_length: int) -> (str, int):
 
     start_index += max_length
     t = start_index-max_length
-    return data[t:length].decode('ascii'), start_index
+    return bytes(data[t:length]).decode('ascii'), start_index
 
 
-class UtfFile:
+class UtfHeader(NamedTuple):
+    node_block_offset: int
+    node_size: int
+    header_size: int
+    string_block_offset: int
+    string_block_size: int
+    data_block_offset: int
 
-    def load_utf_file(self, path: str) -> Dict:
-        with open(path, mode="br") as file:
-            buf = file.read()
 
-        pos = 0
-        sig, pos = get_int(buf, pos)
-        ver, pos = get_int(buf, pos)
+class UtfIndexEntry(NamedTuple):
+    offset: int
+    size: int
+    flags: int
 
-        if sig != 0x20465455 or ver != 0x101:
-            raise Exception("Unsupported")
 
-        # get node chink info
-        node_block_offset, pos = get_int(buf, pos)
-        node_size, pos = get_int(buf, pos)
+INDEX_VERSION = 1
 
-        unknown1, pos = get_int(buf, pos)
-        header_size, pos = get_int(buf, pos)
+# signature, version, node block offset, node size, unknown, header size, string block offset, string block size,
+# unknown, data block offset
+HEADER_STRUCT = struct.Struct("<8i4xi")
+# peer offset, name offset, flags, zero, child offset, allocated size, size, size2, u1, u2, u3
+NODE_STRUCT = struct.Struct("<11i")
 
-        # get string chunk info
-        string_block_offset, pos = get_int(buf, pos)
-        string_block_size, pos = get_int(buf, pos)
 
-        pos += 4
+class UtfFile:
 
-        # get data chunk info
+    def __init__(self):
+        self.mapped: mmap.mmap = None
+        self.path: str = None
+        self.index: Dict[str, UtfIndexEntry] = None
 
-        data_block_offset, pos = get_int(buf, pos)
+    def load_utf_file(self, path: str, use_mmap: bool = False) -> Dict:
+        with open(path, mode="br") as file:
+            if use_mmap:
+                # leaf values become memoryview slices of the mapping, pages are only read when a value is decoded
+                self.close()
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                buf = self.mapped
+            else:
+                buf = file.read()
 
+        header = self.read_header(buf)
         base = {}
+        self.parse_node(buf, header, base)
+        return base
 
-        # load the nodes recursively
-        self.parse_node(buf, node_block_offset, 0, string_block_offset, data_block_offset, base)
+    def close(self):
+        # the mapping stays open while any value view of it is alive
+        if self.mapped is not None:
+            try:
+                self.mapped.close()
+            except BufferError:
+                pass
+            self.mapped = None
+
+    @staticmethod
+    def read_header(buf) -> UtfHeader:
+        if len(buf) < HEADER_STRUCT.size:
+            raise Exception("Unsupported")
+        sig, ver, node_block_offset, node_size, _, header_size, string_block_offset, string_block_size, \
+            data_block_offset = HEADER_STRUCT.unpack_from(buf, 0)
 
-        return base
+        if sig != 0x20465455 or ver != 0x101:
+            raise Exception("Unsupported")
 
-    def parse_node(self, buf: bytes, node_block_start: int, node_start: int, string_block_offset: int, data_block_offset: int,
-                   parent: Dict):
-        offset: int = node_block_start + node_start
-        while True:
-            peer_offset, offset = get_int(buf, offset)
-            name_offset, offset = get_int(buf, offset)
-            flags, offset = get_int(buf, offset)
-            zero, offset = get_int(buf, offset)
-            child_offset, offset = get_int(buf, offset)
-            allocated_size, offset = get_int(buf, offset)
-            size, offset = get_int(buf, offset)
-            size2, offset = get_int(buf, offset)
-            u1, offset = get_int(buf, offset)
-            u2, offset = get_int(buf, offset)
-            u3, offset = get_int(buf, offset)
-
-            # extract the node name
-            length = 0
-            for i in range(string_block_offset + name_offset, len(buf)):
-                if buf[i] == 0:
-                    break
-                length += 1
-
-            t = string_block_offset + name_offset
-            name = buf[t:t + length].decode("ASCII")
+        return UtfHeader(node_block_offset, node_size, header_size, string_block_offset, string_block_size,
+                         data_block_offset)
+
+    @staticmethod
+    def read_string_table(strings: bytes, base_offset: int = 0) -> Dict[int, str]:
+        # maps the offset of every NUL terminated name in the string block to its decoded value
+        table = {}
+        start = 0
+        while start < len(strings):
+            end = strings.find(b"\0", start)
+            if end < 0:
+                end = len(strings)
+            if end > start:
+                try:
+                    table[start + base_offset] = strings[start:end].decode("ASCII")
+                except UnicodeDecodeError:
+                    pass
+            start = end + 1
+        return table
+
+    @staticmethod
+    def walk_nodes(node_block, strings: bytes, names: Dict[int, str] = None) \
+            -> Iterator[Tuple[int, int, str, int, int, int, int]]:
+        # depth first walk with an explicit stack, yields
+        # (node offset, parent node offset or -1, name, flags, child offset, size, size2) for every node
+        if names is None:
+            names = UtfFile.read_string_table(strings)
+        visited = set()
+        stack = [(0, -1)]
+        while stack:
+            node_offset, parent_offset = stack.pop()
+            if node_offset in visited:
+                raise ValueError(f"Cycle in UTF node tree at node offset {node_offset:#x}")
+            visited.add(node_offset)
+            if node_offset < 0 or node_offset + NODE_STRUCT.size > len(node_block):
+                raise ValueError(f"UTF node offset {node_offset:#x} is outside of the node block")
+
+            peer_offset, name_offset, flags, _, child_offset, _, size, size2, _, _, _ = \
+                NODE_STRUCT.unpack_from(node_block, node_offset)
+
+            name = names.get(name_offset)
+            if name is None:
+                # name offset does not point at the start of a string
+                end = strings.find(b"\0", name_offset)
+                name = strings[name_offset:end if end >= 0 else len(strings)].decode("ASCII")
+                names[name_offset] = name
+
+            if peer_offset != 0:
+                stack.append((peer_offset, parent_offset))
+            if child_offset > 0 and flags == 0x10:
+                stack.append((child_offset, node_offset))
 
-            # extract data if this is a leaf
+            yield node_offset, parent_offset, name, flags, child_offset, size, size2
+
+    def parse_node(self, buf, header: UtfHeader, parent: Dict):
+        string_end = min(header.string_block_offset + header.string_block_size, len(buf))
+        strings = buf[header.string_block_offset:string_end]
+        node_block = memoryview(buf)[header.node_block_offset:]
+        is_mapped = isinstance(buf, mmap.mmap)
 
-            data = bytearray(size)
+        nodes = {-1: parent}
+        for node_offset, parent_offset, name, flags, child_offset, size, size2 in self.walk_nodes(node_block, strings):
+            # extract data if this is a leaf
             if (flags & 0xFF) == 0x80:
                 if size != size2:
                     print(f"Possible compression being used on {name}")
-                t = child_offset + data_block_offset
-                data[0:size] = buf[t:t+size]
+                t = child_offset + header.data_block_offset
+                if is_mapped:
+                    data = memoryview(buf)[t:t+size]
+                else:
+                    data = bytearray(size)
+                    data[0:size] = buf[t:t+size]
             else:
                 data = bytearray(0)
 
             node = {'name': name, 'value': data, 'text': name}
-            parent[name] = node
-
-            if child_offset > 0 and flags == 0x10:
-                self.parse_node(buf, node_block_start, child_offset, string_block_offset, data_block_offset, node)
-
-            if peer_offset == 0:
-                break
+            nodes[parent_offset][name] = node
+            nodes[node_offset] = node
 
-            offset = node_block_start + peer_offset
+    def build_index(self, path: str) -> Dict[str, UtfIndexEntry]:
+        # reads only the header, node and string blocks
+        with open(path, mode="br") as file:
+            header = self.read_header(file.read(HEADER_STRUCT.size))
+            file.seek(header.node_block_offset)
+            node_block = file.read(header.node_size)
+            file.seek(header.string_block_offset)
+            strings = file.read(header.string_block_size)
+
+        index = {}
+        paths = {-1: ()}
+        for node_offset, parent_offset, name, flags, child_offset, size, _ in self.walk_nodes(node_block, strings):
+            node_path = paths[parent_offset] + (name,) if parent_offset >= 0 else ()
+            paths[node_offset] = node_path
+            if parent_offset < 0:
+                # the root node is the empty path
+                continue
+            if (flags & 0xFF) == 0x80:
+                entry = UtfIndexEntry(header.data_block_offset + child_offset, size, flags)
+            else:
+                entry = UtfIndexEntry(0, 0, flags)
+            index["/".join(node_path)] = entry
+        return index
+
+    def open_index(self, path: str, index_path: str = None) -> Dict[str, UtfIndexEntry]:
+        self.path = path
+        self.index = None
+        if index_path and os.path.exists(index_path):
+            self.index = self.load_index(path, index_path)
+        if self.index is None:
+            self.index = self.build_index(path)
+            if index_path:
+                self.save_index(index_path)
+        return self.index
+
+    @staticmethod
+    def _source_stamp(path: str) -> Dict:
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def save_index(self, index_path: str):
+        data = {
+            'version': INDEX_VERSION,
+            'source': self._source_stamp(self.path),
+            'nodes': [[node_path, *entry] for node_path, entry in self.index.items()],
+        }
+        with open(index_path, "w") as outfile:
+            json.dump(data, outfile)
+
+    def load_index(self, path: str, index_path: str):
+        # returns None if the index is stale or unreadable
+        try:
+            with open(index_path) as infile:
+                data = json.load(infile)
+            if data.get('version') != INDEX_VERSION or data.get('source') != self._source_stamp(path):
+                return None
+            return {node[0]: UtfIndexEntry(*node[1:]) for node in data['nodes']}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def iter_paths(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def get(self, node_path: str) -> bytes:
+        entry = self.index[node_path.strip("/")]
+        if entry.size == 0:
+            return b""
+        with open(self.path, mode="br") as file:
+            file.seek(entry.offset)
+            return file.read(entry.size)
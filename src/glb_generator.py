@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import json
+import struct
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+from obj_generator import ObjModel, Material
+from prisData import PartHierarchy
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+def column_major(matrix: np.ndarray) -> List[float]:
+    return matrix.T.flatten().tolist()
+
+
+def affine(matrix: np.ndarray) -> np.ndarray:
+    # the part transforms have an empty last row, vertices are always taken with w = 1 so it is the same mapping
+    result = np.array(matrix, dtype=np.float64)
+    result[3] = (0, 0, 0, 1)
+    return result
+
+
+class GlbBuilder:
+
+    def __init__(self):
+        self.gltf = {
+            'asset': {'version': '2.0', 'generator': 'CFW model extractor'},
+            'scene': 0,
+            'scenes': [{'nodes': [0]}],
+            'nodes': [],
+            'meshes': [],
+            'materials': [],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': [],
+        }
+        self.chunks: List[bytes] = []
+        self.byte_length = 0
+        self.material_indices: Dict[str, int] = {}
+        self.images: Dict[str, int] = {}
+
+    def add_buffer_view(self, data: np.ndarray, target: int) -> int:
+        # raw little endian bytes of the array, every view starts 4 byte aligned
+        raw = np.ascontiguousarray(data).tobytes()
+        self.gltf['bufferViews'].append({'buffer': 0, 'byteOffset': self.byte_length, 'byteLength': len(raw),
+                                         'target': target})
+        self.chunks.append(raw)
+        self.byte_length += len(raw)
+        padding = -len(raw) % 4
+        if padding:
+            self.chunks.append(b"\0" * padding)
+            self.byte_length += padding
+        return len(self.gltf['bufferViews']) - 1
+
+    def add_accessor(self, data: np.ndarray, accessor_type: str, target: int, with_bounds=False) -> int:
+        if target == ELEMENT_ARRAY_BUFFER:
+            data = data.astype("<u4")
+            component_type = UNSIGNED_INT
+        else:
+            data = data.astype("<f4")
+            component_type = FLOAT
+        accessor = {'bufferView': self.add_buffer_view(data, target), 'componentType': component_type,
+                    'count': len(data), 'type': accessor_type}
+        if with_bounds and len(data):
+            accessor['min'] = data.min(axis=0).tolist()
+            accessor['max'] = data.max(axis=0).tolist()
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add_material(self, mat: Material) -> int:
+        if mat.name in self.material_indices:
+            return self.material_indices[mat.name]
+        diffuse = mat.diffuse.vertices[:3].tolist()
+        # Blinn-Phong exponent to roughness, Ns in the MTL is shininess * 50
+        roughness = float(np.sqrt(2 / (mat.shininess * 50 + 2))) if mat.shininess else 1.0
+        pbr = {'baseColorFactor': [*diffuse, 1.0], 'metallicFactor': 0.0, 'roughnessFactor': roughness}
+        if mat.has_texture:
+            pbr['baseColorTexture'] = {'index': self.add_texture(mat.diffuse_map)}
+        self.gltf['materials'].append({'name': mat.name, 'pbrMetallicRoughness': pbr})
+        self.material_indices[mat.name] = len(self.gltf['materials']) - 1
+        return self.material_indices[mat.name]
+
+    def add_texture(self, uri: str) -> int:
+        # glTF images are PNG or JPEG, the .tga textures are referenced by the .png name --textures --png writes
+        uri = os.path.splitext(uri)[0] + ".png"
+        if uri not in self.images:
+            self.gltf.setdefault('images', []).append({'uri': uri})
+            self.gltf.setdefault('textures', []).append({'source': len(self.gltf['images']) - 1})
+            self.images[uri] = len(self.gltf['textures']) - 1
+        return self.images[uri]
+
+    def add_mesh(self, name: str, model: ObjModel) -> int:
+        # glTF has a single index per vertex, the batch entries the face chains point at are exactly that:
+        # a position, the texture coordinate of the batch and the normal of the position. All attributes need the
+        # same count, the batch entries both batch lists have are the ones the validated chains can reach
+        batch_count = min(len(model.vertex_batch_list), len(model.texture_batch_list))
+        batch = model.vertex_batch_list[:batch_count].astype(np.int64)
+        positions = self.add_accessor(model.vertices[batch], 'VEC3', ARRAY_BUFFER, with_bounds=True)
+        normals = self.add_accessor(model.surface_normals[model.vertex_normals[batch]], 'VEC3', ARRAY_BUFFER)
+        uvs = self.add_accessor(model.texture_coord_list[model.texture_batch_list[:batch_count]], 'VEC2',
+                                ARRAY_BUFFER)
+
+        primitives = []
+        for face_group in model.face_groups:
+            primitives.append({
+                'attributes': {'POSITION': positions, 'NORMAL': normals, 'TEXCOORD_0': uvs},
+                'indices': self.add_accessor(face_group.vertex_chain, 'SCALAR', ELEMENT_ARRAY_BUFFER),
+                'material': self.add_material(model.materials[face_group.material_index]),
+            })
+        self.gltf['meshes'].append({'name': name, 'primitives': primitives})
+        return len(self.gltf['meshes']) - 1
+
+    def add_node(self, node: Dict, parent: int = None) -> int:
+        self.gltf['nodes'].append(node)
+        index = len(self.gltf['nodes']) - 1
+        if parent is not None:
+            self.gltf['nodes'][parent].setdefault('children', []).append(index)
+        return index
+
+    def write(self, path: str):
+        with open(path, "wb") as outfile:
+            self.write_to(outfile)
+
+    def write_to(self, outfile):
+        # glTF does not allow empty arrays or buffers, a model without meshes has no buffer and no binary chunk
+        if self.byte_length:
+            self.gltf['buffers'].append({'byteLength': self.byte_length})
+        for key in ('meshes', 'materials', 'accessors', 'bufferViews', 'buffers'):
+            if not self.gltf[key]:
+                del self.gltf[key]
+        json_chunk = json.dumps(self.gltf, separators=(",", ":")).encode("utf-8")
+        json_chunk += b" " * (-len(json_chunk) % 4)
+        total = 12 + 8 + len(json_chunk) + (8 + self.byte_length if self.byte_length else 0)
+        outfile.write(struct.pack("<3I", GLB_MAGIC, GLB_VERSION, total))
+        outfile.write(struct.pack("<2I", len(json_chunk), CHUNK_JSON))
+        outfile.write(json_chunk)
+        if self.byte_length:
+            outfile.write(struct.pack("<2I", self.byte_length, CHUNK_BIN))
+            for chunk in self.chunks:
+                outfile.write(chunk)
+
+
+def export_to_glb(meshes: List[Tuple[str, ObjModel]], path, scale=1, hierarchy: PartHierarchy = None) -> List[str]:
+    build_glb(meshes, str(os.path.basename(path)).split(".")[0], scale, hierarchy).write(path)
+    return [path]
+
+
+def build_glb(meshes: List[Tuple[str, ObjModel]], basename: str, scale=1,
+              hierarchy: PartHierarchy = None) -> GlbBuilder:
+    # meshes are (embedded file name, loaded model). Every part of the hierarchy becomes a node with its transform
+    # relative to the parent part, the meshes hang below the node of their part
+    builder = GlbBuilder()
+    root = builder.add_node({'name': basename, 'scale': [float(scale)] * 3})
+
+    part_nodes: Dict[str, int] = {}
+
+    def part_node(name: str) -> int:
+        # walks up to the first part that already has a node, then adds the missing ones top down
+        chain = []
+        while name not in part_nodes and hierarchy.part(name) is not None:
+            chain.append(name)
+            name = hierarchy.part(name).parent_name
+        parent = part_nodes.get(name, root)
+        for name in reversed(chain):
+            world = affine(hierarchy.world_transforms[name])
+            parent_part = hierarchy.part(hierarchy.part(name).parent_name)
+            local = world
+            if parent_part is not None:
+                try:
+                    local = np.linalg.solve(affine(hierarchy.world_transforms[parent_part.child_name]), world)
+                except np.linalg.LinAlgError:
+                    # a degenerate parent can not be undone, place the part directly below the root
+                    parent = root
+            parent = part_nodes[name] = builder.add_node({'name': name, 'matrix': column_major(local)}, parent)
+        return parent
+
+    if hierarchy is not None:
+        for name in hierarchy.index:
+            part_node(name)
+
+    for filename, model in meshes:
+        part = hierarchy.part_for_file(filename) if hierarchy is not None else None
+        parent = part_node(part.child_name) if part is not None else root
+        mesh = builder.add_mesh(filename.split(".")[0], model)
+        builder.add_node({'name': filename.split(".")[0], 'mesh': mesh}, parent)
+    return builder
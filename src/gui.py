@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tkinter import *
+from tkinter import filedialog, messagebox, ttk
+from typing import List, Dict, Tuple
+
+from extractor import VERSION
+from naming import default_output_name, default_material_name
+from conversion import extract
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+# how often the window picks up messages of the conversion processes, in milliseconds
+POLL_INTERVAL = 100
+
+# the message queue and cancel event of the window, set in every pool worker by set_channels
+messages = None
+cancel_event = None
+
+
+def set_channels(message_queue, event):
+    # process pool initializer, the queue and the event can only be handed to a worker when it starts
+    global messages, cancel_event
+    messages = message_queue
+    cancel_event = event
+
+
+def convert(source, output, scale):
+    # runs on a pool worker, it only talks to the window through the message queue
+    def progress(done, total, description):
+        if cancel_event.is_set():
+            raise ConversionCancelled()
+        messages.put(("progress", source, done / total, description))
+
+    try:
+        progress(0, 1, "queued")
+        written = extract(source, output, scale, progress=progress)
+        messages.put(("done", source, 1.0, f"{len(written)} files written"))
+    except ConversionCancelled:
+        messages.put(("cancelled", source, 1.0, "cancelled"))
+    except Exception as ex:
+        print(ex)
+        messages.put(("error", source, 1.0, f"{type(ex).__name__}: {ex}"))
+
+
+class Gui:
+
+    def __init__(self):
+        self.filename = ""
+        self.filenames: List[str] = []
+        self.output_filename = ""
+        self.scale = 1
+        # conversions run on worker processes like a batch conversion, they only talk to the window through this
+        # queue
+        self.messages = multiprocessing.Queue()
+        self.executor = None
+        self.cancel_event = multiprocessing.Event()
+        self.progress: Dict[str, float] = {}
+        self.pending = 0
+        self.failed = 0
+
+    def open_input_file(self):
+        filenames = filedialog.askopenfilenames(initialdir=f"{os.getcwd()}", title="Select files",
+                               filetypes=(("all files", "*.*"), ("3db files", "*.3db"), ("cmp files", "*.cmp") ))
+        if filenames:
+            self.filenames = list(filenames)
+            self.filename = self.filenames[0]
+            if len(self.filenames) == 1:
+                self.v_input_name.set(self.filename)
+                self.v_output_name.set(default_output_name(self.filename))
+                self.v_material_name.set(default_material_name(self.filename))
+            else:
+                # several files are converted into one output directory
+                self.v_input_name.set(f"{len(self.filenames)} files: "
+                                      + ", ".join(os.path.basename(x) for x in self.filenames))
+                self.v_output_name.set(os.path.dirname(self.filename))
+                self.v_material_name.set("")
+
+    def open_output_file(self):
+        if len(self.filenames) > 1:
+            output_dir = filedialog.askdirectory(initialdir=self.v_output_name.get(), title="Select output directory")
+            if output_dir:
+                self.v_output_name.set(output_dir)
+            return
+        output_filename: str = filedialog.asksaveasfilename(initialdir=f"{os.path.dirname(self.v_output_name.get())}", title="Select file",
+                                     filetypes=(("Wavefront OBJ", "*.obj"), ("all files", "*.*")))
+        if output_filename:
+            self.output_filename = output_filename
+            if not self.output_filename.endswith(".obj"):
+                self.output_filename += ".obj"
+
+            if self.output_filename:
+                self.v_output_name.set(self.output_filename)
+                self.v_material_name.set(self.output_filename.replace("obj", "mtl"))
+
+    def load_gui(self):
+        self.window = Tk()
+        window = self.window
+        window.resizable(False, False)
+        window.title(f"Extractor {VERSION}")
+        window.protocol("WM_DELETE_WINDOW", self.close)
+        title_label = Label(window, text="Conquest: Frontier Wars model extractor", font=("Arial Bold", 16))
+        title_label.grid(column=0, row=0)
+
+
+        #input
+        input_frame = LabelFrame(window, text="Input", padx=5, pady=5)
+
+        input_label = Label(input_frame, text="Input file:", padx=10, pady=10)
+        input_label.grid(column=0, row=0)
+
+        self.v_input_name = StringVar()
+        input_name_entry = Entry(input_frame, textvariable=self.v_input_name, width=80, state="readonly")
+        input_name_entry.grid(column=1, row=0)
+
+        input_button = Button(input_frame, text="Browse", command=self.open_input_file)
+        input_button.grid(column=2, row=0)
+
+        input_frame.grid(column=0,row=1)
+
+
+        #output
+        output_frame = LabelFrame(window, text="Output", padx=5, pady=5)
+
+        output_label = Label(output_frame, text="Scale:", padx=10, pady=10)
+        output_label.grid(column=0, row=0)
+
+        self.v_scale = StringVar()
+        self.v_scale.set("1")
+        output_name_entry = Entry(output_frame, textvariable=self.v_scale, width=80)
+        output_name_entry.grid(column=1, row=0)
+
+        output_label = Label(output_frame, text="Output file:", padx=10, pady=10)
+        output_label.grid(column=0, row=1)
+
+        self.v_output_name = StringVar()
+        output_name_entry = Entry(output_frame, textvariable=self.v_output_name, width=80, state="readonly")
+        output_name_entry.grid(column=1, row=1)
+
+        output_button = Button(output_frame, text="Browse", command=self.open_output_file)
+        output_button.grid(column=2, row=1)
+
+        output_frame.grid(column=0, row=2)
+
+        material_label = Label(output_frame, text="Material file:", padx=10, pady=10)
+        material_label.grid(column=0, row=2)
+
+        self.v_material_name = StringVar()
+        output_name_entry = Entry(output_frame, textvariable=self.v_material_name, width=80, state="readonly")
+        output_name_entry.grid(column=1, row=2)
+
+
+        #progress
+        progress_frame = LabelFrame(window, text="Progress", padx=5, pady=5)
+
+        self.v_progress = DoubleVar()
+        progress_bar = ttk.Progressbar(progress_frame, variable=self.v_progress, maximum=100, length=640)
+        progress_bar.grid(column=0, row=0, pady=5)
+
+        self.v_status = StringVar()
+        status_label = Label(progress_frame, textvariable=self.v_status, anchor="w", width=90)
+        status_label.grid(column=0, row=1)
+
+        self.results_list = Listbox(progress_frame, height=5, width=90)
+        self.results_list.grid(column=0, row=2, pady=5)
+
+        progress_frame.grid(column=0, row=3)
+
+        button_frame = Frame(window)
+        self.extract_button = Button(button_frame, text="Extract", command=self.extract)
+        self.extract_button.grid(column=0, row=0, padx=5)
+        self.cancel_button = Button(button_frame, text="Cancel", command=self.cancel, state=DISABLED)
+        self.cancel_button.grid(column=1, row=0, padx=5)
+        button_frame.grid(column=0, row=4, pady=5)
+
+        window.grid_columnconfigure(0, weight=1)
+        window.grid_rowconfigure(0, weight=1)
+
+        window.mainloop()
+
+    def conversions(self) -> List[Tuple[str, str]]:
+        if len(self.filenames) > 1:
+            output_dir = self.v_output_name.get()
+            return [(x, default_output_name(os.path.join(output_dir, os.path.basename(x)))) for x in self.filenames]
+        return [(self.v_input_name.get(), self.v_output_name.get())]
+
+    def extract(self):
+        if self.executor is not None:
+            return
+        try:
+            scale = float(self.v_scale.get())
+        except ValueError as ex:
+            messagebox.showerror("Error", ex)
+            return
+        conversions = self.conversions()
+        self.cancel_event = multiprocessing.Event()
+        self.progress = {source: 0.0 for source, _ in conversions}
+        self.pending = len(conversions)
+        self.failed = 0
+        self.results_list.delete(0, END)
+        self.v_progress.set(0)
+        self.v_status.set("Starting")
+        self.executor = ProcessPoolExecutor(max_workers=min(len(conversions), os.cpu_count() or 1),
+                                            initializer=set_channels, initargs=(self.messages, self.cancel_event))
+        for source, output in conversions:
+            future = self.executor.submit(convert, source, output, scale)
+            future.add_done_callback(lambda f, source=source: self.worker_lost(f, source))
+        self.extract_button.config(state=DISABLED)
+        self.cancel_button.config(state=NORMAL)
+        self.window.after(POLL_INTERVAL, self.poll)
+
+    def worker_lost(self, future, source):
+        # convert reports its own errors, an exception here means the worker process died or the pool was shut down
+        if not future.cancelled() and future.exception() is not None:
+            ex = future.exception()
+            self.messages.put(("error", source, 1.0, f"{type(ex).__name__}: {ex}"))
+
+    def poll(self):
+        while True:
+            try:
+                kind, source, fraction, description = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            self.progress[source] = fraction
+            if kind == "progress":
+                self.v_status.set(f"{os.path.basename(source)}: {description}")
+                continue
+            self.pending -= 1
+            if kind != "done":
+                self.failed += 1
+            self.results_list.insert(END, f"{os.path.basename(source)}: {description}")
+        self.v_progress.set(100 * sum(self.progress.values()) / max(len(self.progress), 1))
+        if self.pending:
+            self.window.after(POLL_INTERVAL, self.poll)
+        else:
+            self.finish()
+
+    def finish(self):
+        self.executor.shutdown(wait=False)
+        self.executor = None
+        self.extract_button.config(state=NORMAL)
+        self.cancel_button.config(state=DISABLED)
+        if self.cancel_event.is_set():
+            self.v_status.set("Cancelled")
+        elif self.failed:
+            self.v_status.set(f"{self.failed} of {len(self.progress)} failed")
+            messagebox.showerror("Error", "\n".join(self.results_list.get(0, END)))
+        else:
+            self.v_status.set("Done")
+            messagebox.showinfo("Success", "Object extracted" if len(self.progress) == 1 else
+                                f"{len(self.progress)} objects extracted")
+
+    def cancel(self):
+        # running conversions stop at their next phase, queued ones right when they start. A long phase, like writing
+        # a large OBJ, is finished first
+        self.cancel_event.set()
+        self.v_status.set("Cancelling, running files stop after their current step")
+
+    def close(self):
+        self.cancel_event.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.window.destroy()
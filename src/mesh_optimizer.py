@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from obj_generator import ObjModel
+
+CACHE_SIZE = 32
+# models with more triangles are only welded, the reordering takes about 2 seconds per 100k triangles
+MAX_REORDER_TRIANGLES = 250000
+
+# vertex scoring of Tom Forsyth's linear-speed vertex cache optimisation
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+
+def unique_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # rows compared bit for bit, returns the first occurrence of every distinct row in order of appearance and the
+    # index of every input row in that list
+    rows = np.ascontiguousarray(rows)
+    if rows.ndim == 1:
+        rows = rows.reshape(-1, 1)
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.ravel()]
+
+
+def weld(model: ObjModel):
+    # merges identical normals, positions (together with their normal), texture coordinates and batch entries,
+    # anything the face chains do not reach is dropped
+    chains = [face_group.vertex_chain.astype(np.int64) for face_group in model.face_groups]
+    used_batch = np.unique(np.concatenate(chains)) if chains else np.zeros(0, dtype=np.int64)
+    vertex = model.vertex_batch_list[used_batch].astype(np.int64)
+    uv = model.texture_batch_list[used_batch].astype(np.int64)
+
+    used_vertices, vertex_inverse = np.unique(vertex, return_inverse=True)
+    normal = model.vertex_normals[used_vertices].astype(np.int64)
+    normal_keep, normal_inverse = unique_rows(model.surface_normals[normal])
+
+    # a position is only merged with another one that also shares the normal
+    vertex_keys = np.concatenate((model.vertices[used_vertices].view(np.uint32),
+                                  normal_inverse.astype(np.uint32).reshape(-1, 1)), axis=1)
+    vertex_keep, vertex_remap = unique_rows(vertex_keys)
+
+    used_uvs, uv_inverse = np.unique(uv, return_inverse=True)
+    uv_keep, uv_remap = unique_rows(model.texture_coord_list[used_uvs])
+
+    batch_keys = np.stack((vertex_remap[vertex_inverse], uv_remap[uv_inverse]), axis=1)
+    batch_keep, batch_remap = unique_rows(batch_keys)
+
+    model.surface_normals = model.surface_normals[normal[normal_keep]]
+    model.vertices = model.vertices[used_vertices[vertex_keep]]
+    model.vertex_normals = normal_inverse[vertex_keep].astype(np.uint32)
+    model.texture_coord_list = model.texture_coord_list[used_uvs[uv_keep]]
+    model.vertex_batch_list = batch_keys[batch_keep, 0].astype(np.uint32)
+    model.texture_batch_list = batch_keys[batch_keep, 1].astype(np.uint32)
+
+    # chain entries point at the used batch entries, which are numbered by their position in used_batch
+    chain_remap = batch_remap.astype(np.uint32)
+    for face_group, chain in zip(model.face_groups, chains):
+        face_group.vertex_chain = chain_remap[np.searchsorted(used_batch, chain)]
+
+
+def acmr(chain: np.ndarray, cache_size: int = CACHE_SIZE) -> Tuple[int, int]:
+    # cache misses and triangles of a FIFO post-transform cache
+    cache = deque()
+    cached = set()
+    misses = 0
+    for index in chain.tolist():
+        if index not in cached:
+            misses += 1
+            cache.append(index)
+            cached.add(index)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+    return misses, len(chain) // 3
+
+
+def score_tables(cache_size: int, max_valence: int) -> Tuple[List[float], List[float]]:
+    # vertex score parts by cache position, -1 (not cached) being the last entry, and by remaining triangle count
+    cache_scores = [LAST_TRIANGLE_SCORE] * 3
+    cache_scores += [(1.0 - (i - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER for i in range(3, cache_size)]
+    valence_scores = [-1.0] + [VALENCE_BOOST_SCALE * r ** -VALENCE_BOOST_POWER for r in range(1, max_valence + 1)]
+    return cache_scores + [0.0], valence_scores
+
+
+def optimize_vertex_cache(chain: np.ndarray, cache_size: int = CACHE_SIZE) -> np.ndarray:
+    # reorders the triangles of one chain for post-transform cache hits, vertices and winding are unchanged. The
+    # triangles are picked one at a time, so the per vertex state is kept in plain lists and the scores come from
+    # tables, a NumPy call per step would cost more than the step itself
+    triangles = chain.reshape(-1, 3).tolist()
+    if len(triangles) < 2:
+        return chain
+    vertex_triangles: List[list] = [[] for _ in range(int(chain.max()) + 1)]
+    for t, triangle in enumerate(triangles):
+        for v in triangle:
+            vertex_triangles[v].append(t)
+
+    remaining = [len(x) for x in vertex_triangles]
+    cache_scores, valence_scores = score_tables(cache_size, max(remaining))
+    position = [-1] * len(vertex_triangles)
+    # a vertex without triangles left scores -1, otherwise its cache and valence parts
+    score = [valence_scores[r] for r in remaining]
+    triangle_score = [score[a] + score[b] + score[c] for a, b, c in triangles]
+
+    order = []
+    cache = []
+    best = max(range(len(triangles)), key=triangle_score.__getitem__)
+    added = [False] * len(triangles)
+    next_unadded = 0
+    while best >= 0:
+        added[best] = True
+        order.append(best)
+        triangle = triangles[best]
+        for v in triangle:
+            vertex_triangles[v].remove(best)
+            remaining[v] -= 1
+        # the vertices of the new triangle move to the front of the LRU cache
+        new_cache = triangle + [v for v in cache if v not in triangle]
+        for v in new_cache[cache_size:]:
+            position[v] = -1
+        cache = new_cache[:cache_size]
+        for i, v in enumerate(cache):
+            position[v] = i
+
+        for v in new_cache:
+            r = remaining[v]
+            new_score = cache_scores[position[v]] + valence_scores[r] if r else -1.0
+            delta = new_score - score[v]
+            if delta:
+                score[v] = new_score
+                for t in vertex_triangles[v]:
+                    triangle_score[t] += delta
+
+        best = -1
+        best_score = -1.0
+        for v in cache:
+            for t in vertex_triangles[v]:
+                if triangle_score[t] > best_score:
+                    best, best_score = t, triangle_score[t]
+        if best < 0:
+            # nothing left around the cache, continue with the next triangle in input order
+            while next_unadded < len(triangles) and added[next_unadded]:
+                next_unadded += 1
+            best = next_unadded if next_unadded < len(triangles) else -1
+
+    return np.array(triangles, dtype=chain.dtype)[order].ravel()
+
+
+def model_counts(model: ObjModel) -> Dict[str, int]:
+    return {
+        'vertices': len(model.vertices),
+        'uvs': len(model.texture_coord_list),
+        'normals': len(model.surface_normals),
+        'batch_vertices': len(model.vertex_batch_list),
+    }
+
+
+def model_acmr(model: ObjModel, cache_size: int = CACHE_SIZE) -> float:
+    misses = triangles = 0
+    for face_group in model.face_groups:
+        group_misses, group_triangles = acmr(face_group.vertex_chain, cache_size)
+        misses += group_misses
+        triangles += group_triangles
+    return misses / triangles if triangles else 0.0
+
+
+def optimize_model(model: ObjModel, cache_size: int = CACHE_SIZE) -> Dict:
+    # welds the model and reorders the triangles of every face group in place, returns before/after counts and ACMR.
+    # Models above MAX_REORDER_TRIANGLES keep their triangle order
+    report = {'before': {**model_counts(model), 'acmr': model_acmr(model, cache_size)}}
+    weld(model)
+    report['reordered'] = sum(len(f.vertex_chain) for f in model.face_groups) // 3 <= MAX_REORDER_TRIANGLES
+    if report['reordered']:
+        for face_group in model.face_groups:
+            face_group.vertex_chain = optimize_vertex_cache(face_group.vertex_chain, cache_size)
+    report['after'] = {**model_counts(model), 'acmr': model_acmr(model, cache_size)}
+    return report
+
+
+def format_report(name: str, report: Dict) -> str:
+    before, after = report['before'], report['after']
+    counts = ", ".join(f"{key} {before[key]} -> {after[key]}" for key in before if key != 'acmr')
+    text = f"{name}: {counts}, ACMR {before['acmr']:.3f} -> {after['acmr']:.3f}"
+    if not report['reordered']:
+        text += f", triangles not reordered above {MAX_REORDER_TRIANGLES}"
+    return text
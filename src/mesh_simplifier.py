@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import copy
+
+import numpy as np
+
+from obj_generator import ObjModel
+from mesh_optimizer import weld
+
+# weight of the planes that hold open boundaries and material borders in place, relative to the surface
+FEATURE_WEIGHT = 100.0
+# rounds of picking independent collapses in a pass
+INDEPENDENT_ROUNDS = 4
+
+
+def plane_quadrics(planes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    return np.einsum("ij,ik->ijk", planes, planes) * weights[:, None, None]
+
+
+def unit(vectors: np.ndarray) -> (np.ndarray, np.ndarray):
+    lengths = np.linalg.norm(vectors, axis=1)
+    valid = lengths > 0
+    vectors = vectors.copy()
+    vectors[valid] /= lengths[valid, None]
+    return vectors, lengths
+
+
+def triangle_normals(points: np.ndarray) -> np.ndarray:
+    # points are (triangles, 3 corners, xyz)
+    return np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+
+
+def edge_table(position_triangles: np.ndarray, triangle_groups: np.ndarray, count: int):
+    # the three edges of every triangle with the lower position first, the distinct edges as a * count + b keys, the
+    # index of every triangle edge in those and which distinct edges are feature edges: used by one triangle only, by
+    # more than two, or by triangles of different face groups
+    edges = np.sort(position_triangles[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    unique_keys, inverse, counts = np.unique(edges[:, 0] * count + edges[:, 1], return_inverse=True,
+                                             return_counts=True)
+    edge_groups = np.repeat(triangle_groups, 3)
+    group_min = np.full(len(unique_keys), np.iinfo(np.int64).max)
+    group_max = np.full(len(unique_keys), -1)
+    np.minimum.at(group_min, inverse, edge_groups)
+    np.maximum.at(group_max, inverse, edge_groups)
+    return edges, unique_keys, inverse, (counts != 2) | (group_min != group_max)
+
+
+class Simplifier:
+    # quadric error metric half-edge collapse on the positions of a model, every collapse moves a position onto one
+    # of its neighbours so texture coordinates and normals stay valid. Open boundaries and the borders between face
+    # groups are feature edges: a position on them may only slide along them, corners are kept. A collapse is only
+    # done if every vertex batch entry of the removed position has a batch entry of the target next to it, so UV
+    # and normal seams are kept as well.
+    # The collapses are done in passes with NumPy: each pass costs every candidate collapse, takes the cheapest ones
+    # of positions that are not neighbours, so no two of them touch the same triangle, and checks and applies them
+    # all at once
+
+    def __init__(self, model: ObjModel):
+        self.model = model
+        self.batch_position = model.vertex_batch_list.astype(np.int64)
+        chains = [face_group.vertex_chain.astype(np.int64).reshape(-1, 3) for face_group in model.face_groups]
+        self.triangles = np.concatenate(chains) if chains else np.zeros((0, 3), dtype=np.int64)
+        self.triangle_groups = np.repeat(np.arange(len(chains)), [len(x) for x in chains])
+        self.positions = model.vertices.astype(np.float64)
+
+        # collapses that failed their checks, as u * position count + v
+        self.blocked = np.zeros(0, dtype=np.int64)
+        # fixed so the same model always simplifies the same way
+        self.priority = np.random.default_rng(0).permutation(len(self.positions))
+
+        self.quadrics = np.zeros((len(self.positions), 4, 4))
+        if len(self.triangles):
+            position_triangles = self.batch_position[self.triangles]
+            p0, p1, p2 = (self.positions[position_triangles[:, i]] for i in range(3))
+            normals, lengths = unit(np.cross(p1 - p0, p2 - p0))
+            planes = np.concatenate((normals, -np.einsum("ij,ij->i", normals, p0)[:, None]), axis=1)
+            np.add.at(self.quadrics, position_triangles.ravel(),
+                      np.repeat(plane_quadrics(planes, lengths / 2), 3, axis=0))
+
+            # planes through the feature edges, perpendicular to their triangle
+            edges, _, inverse, is_feature = edge_table(position_triangles, self.triangle_groups, len(self.positions))
+            feature_rows = is_feature[inverse]
+            edge_triangles = np.repeat(np.arange(len(position_triangles)), 3)
+            start = self.positions[edges[feature_rows, 0]]
+            direction, edge_lengths = unit(self.positions[edges[feature_rows, 1]] - start)
+            side, _ = unit(np.cross(direction, normals[edge_triangles[feature_rows]]))
+            side_planes = np.concatenate((side, -np.einsum("ij,ij->i", side, start)[:, None]), axis=1)
+            side_quadrics = plane_quadrics(side_planes, edge_lengths ** 2 * FEATURE_WEIGHT)
+            np.add.at(self.quadrics, edges[feature_rows, 0], side_quadrics)
+            np.add.at(self.quadrics, edges[feature_rows, 1], side_quadrics)
+
+        # positions never move, so a cost only needs the upper triangle of the summed quadrics and the products of
+        # the [x y z 1] terms of the target, the ones off the diagonal counted twice
+        rows, columns = np.triu_indices(4)
+        self.quadrics = self.quadrics[:, rows, columns]
+        point = np.concatenate((self.positions, np.ones((len(self.positions), 1))), axis=1)
+        self.terms = point[:, rows] * point[:, columns] * np.where(rows == columns, 1.0, 2.0)
+
+    def simplify(self, target_triangles: int):
+        while len(self.triangles) > target_triangles:
+            if not self.collapse_pass(len(self.triangles) - target_triangles):
+                # no valid collapse is left, the target can not be reached
+                break
+
+    def collapse_pass(self, needed: int) -> bool:
+        count = len(self.positions)
+        position_triangles = self.batch_position[self.triangles]
+        _, edge_keys, _, is_feature = edge_table(position_triangles, self.triangle_groups, count)
+        a, b = edge_keys // count, edge_keys % count
+        feature_count = np.bincount(np.concatenate((a[is_feature], b[is_feature])), minlength=count)
+
+        # u -> v in both directions of every edge, a position on feature edges only moves along one of them
+        u, v, feature = np.concatenate((a, b)), np.concatenate((b, a)), np.tile(is_feature, 2)
+        allowed = (feature_count[u] == 0) | ((feature_count[u] <= 2) & feature)
+        if len(self.blocked):
+            allowed &= ~np.isin(u * count + v, self.blocked)
+        u, v = u[allowed], v[allowed]
+        if not len(u):
+            return False
+        # [x y z 1] (Qu + Qv) [x y z 1]^T at the position of v
+        own = np.einsum("ij,ij->i", self.quadrics, self.terms)
+        cost = np.einsum("ij,ij->i", self.quadrics[u], self.terms[v]) + own[v]
+
+        # the first cheapest collapse of every position, only the cheapest of those are taken in this pass
+        lowest = np.full(count, np.inf)
+        np.minimum.at(lowest, u, cost)
+        cheapest = np.flatnonzero(cost == lowest[u])[::-1]
+        first = np.full(count, -1)
+        first[u[cheapest]] = cheapest
+        best = first[first >= 0]
+        best = best[np.argsort(cost[best], kind="stable")][:max(1, min(needed, len(best) // 3))]
+
+        # only u moves in a collapse, so collapses of positions that are not neighbours touch different triangles.
+        # They are picked in rounds by a fixed random priority, a position that is already a target is not picked
+        free = np.zeros(count, dtype=bool)
+        free[u[best]] = True
+        selected = np.zeros(count, dtype=bool)
+        target = np.zeros(count, dtype=bool)
+        best_v = np.zeros(count, dtype=np.int64)
+        best_v[u[best]] = v[best]
+        for _ in range(INDEPENDENT_ROUNDS):
+            free &= ~target
+            priority = np.where(free, self.priority, count)
+            nearest = priority.copy()
+            np.minimum.at(nearest, a, priority[b])
+            np.minimum.at(nearest, b, priority[a])
+            picked = np.flatnonzero(free & (self.priority == nearest))
+            # one collapse per target, so no two collapses can turn into the same triangle
+            picked = picked[np.argsort(self.priority[picked], kind="stable")]
+            picked = picked[np.unique(best_v[picked], return_index=True)[1]]
+            picked = picked[~target[best_v[picked]]]
+            if not len(picked):
+                break
+            selected[picked] = True
+            target[best_v[picked]] = True
+            reached = np.zeros(count, dtype=bool)
+            reached[picked] = True
+            free[a[reached[b]]] = False
+            free[b[reached[a]]] = False
+            free[picked] = False
+        chosen = best[selected[u[best]]]
+        u, v = u[chosen], v[chosen]
+
+        # one row per chosen collapse and triangle corner of u
+        corner_position = position_triangles.ravel()
+        corner_order = np.argsort(corner_position, kind="stable")
+        degree = np.bincount(corner_position, minlength=count)
+        first_corner = np.cumsum(degree) - degree
+        row_degree = degree[u]
+        row_collapse = np.repeat(np.arange(len(u)), row_degree)
+        row_offset = np.arange(len(row_collapse)) - np.repeat(np.cumsum(row_degree) - row_degree, row_degree)
+        row_corner = corner_order[first_corner[u][row_collapse] + row_offset]
+        row_triangle = row_corner // 3
+        row_batch = self.triangles.ravel()[row_corner]
+        row_positions = position_triangles[row_triangle]
+        is_v = row_positions == v[row_collapse][:, None]
+        shared = is_v.any(axis=1)
+
+        # the triangles holding u and v give the batch entry of v that replaces each batch entry of u, it has to be
+        # the same in all of them
+        batch_count = len(self.batch_position)
+        keys = row_collapse[shared] * batch_count + row_batch[shared]
+        replacements = self.triangles[row_triangle[shared], is_v[shared].argmax(axis=1)]
+        order = np.lexsort((replacements, keys))
+        keys, replacements = keys[order], replacements[order]
+        invalid = np.zeros(len(u), dtype=bool)
+        conflict = (keys[1:] == keys[:-1]) & (replacements[1:] != replacements[:-1])
+        invalid[keys[1:][conflict] // batch_count] = True
+
+        # the other triangles of u need a replacement for their batch entry and must not be turned around
+        others = ~shared
+        other_collapse = row_collapse[others]
+        other_keys = other_collapse * batch_count + row_batch[others]
+        found = np.minimum(np.searchsorted(keys, other_keys), max(len(keys) - 1, 0))
+        has_replacement = keys[found] == other_keys if len(keys) else np.zeros(len(other_keys), dtype=bool)
+        invalid[other_collapse[~has_replacement]] = True
+        before = self.positions[row_positions[others]]
+        after = np.where((row_positions[others] == u[other_collapse][:, None])[:, :, None],
+                         self.positions[v[other_collapse]][:, None, :], before)
+        flipped = np.einsum("ij,ij->i", triangle_normals(before), triangle_normals(after)) <= 0
+        invalid[other_collapse[flipped]] = True
+        # a rejected collapse is not tried again, the next cheapest one of its position is
+        self.blocked = np.union1d(self.blocked, u[invalid] * count + v[invalid])
+
+        # chosen is ordered by cost, the cheapest ones that stay within the target are applied
+        removed = np.bincount(row_collapse[shared], minlength=len(u)) * ~invalid
+        applied = ~invalid & (np.cumsum(removed) - removed < needed)
+        moved = applied[other_collapse]
+        corners = row_corner[others][moved]
+        self.triangles[corners // 3, corners % 3] = replacements[found[moved]]
+        np.add.at(self.quadrics, v[applied], self.quadrics[u[applied]])
+        alive = np.ones(len(self.triangles), dtype=bool)
+        alive[row_triangle[shared][applied[row_collapse[shared]]]] = False
+        self.triangles = self.triangles[alive]
+        self.triangle_groups = self.triangle_groups[alive]
+        return bool(applied.any()) or bool(invalid.any())
+
+    def result(self) -> ObjModel:
+        lod = copy.copy(self.model)
+        lod.face_groups = []
+        order = np.argsort(self.triangle_groups, kind="stable")
+        counts = np.bincount(self.triangle_groups, minlength=len(self.model.face_groups))
+        chains = np.split(self.triangles[order], np.cumsum(counts)[:-1])
+        for face_group, chain in zip(self.model.face_groups, chains):
+            group = copy.copy(face_group)
+            group.vertex_chain = chain.ravel().astype(np.uint32)
+            lod.face_groups.append(group)
+        weld(lod)
+        return lod
+
+
+def simplify_model(model: ObjModel, target_triangles: int) -> ObjModel:
+    # new model with about target_triangles triangles, the given model is not changed. When not a single triangle
+    # can be removed the given model itself is returned, so an unchanged level can be told apart with `is`
+    if triangle_count(model) <= target_triangles:
+        return model
+    simplifier = Simplifier(model)
+    simplifier.simplify(target_triangles)
+    if len(simplifier.triangles) == triangle_count(model):
+        return model
+    return simplifier.result()
+
+
+def lod_target(triangles: int, ratio: float) -> int:
+    # every level is measured against the full detail mesh, also when it is simplified from the level before it
+    return int(round(triangles * ratio))
+
+
+def triangle_count(model: ObjModel) -> int:
+    return sum(len(face_group.vertex_chain) for face_group in model.face_groups) // 3
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from filereader3db import UtfFile
+from obj_generator import ObjModel
+from batch import find_sources, run_jobs
+
+# errors make the OBJ unwritable or broken, warnings are written as they are
+CHECKS = {
+    'non_finite_vertices': "vertices with NaN or infinite coordinates",
+    'non_finite_normals': "normals with NaN or infinite coordinates",
+    'non_finite_uvs': "texture coordinates that are NaN or infinite",
+    'chain_length': "face vertex chains with a length not divisible by 3",
+    'material_index': "face groups with a material past the material library",
+    'chain_index': "face vertex chain entries past the vertex or texture batch list",
+    'vertex_index': "vertex batch entries past the vertex list",
+    'vertex_normal_index': "vertices without a vertex normal entry",
+    'normal_index': "vertex normal entries past the normal list",
+    'uv_index': "texture batch entries past the texture vertex list",
+    'degenerate_triangles': "degenerate triangles",
+}
+
+
+def issue(check: str, values: np.ndarray, limit: int = None, face_groups: np.ndarray = None) -> Dict:
+    # values are the offending entries, only their count and for index checks the largest one are kept
+    result = {'check': check, 'count': int(len(values))}
+    if limit is not None:
+        result['max'] = int(values.max())
+        result['limit'] = int(limit)
+    if face_groups is not None:
+        result['face_groups'] = np.unique(face_groups).tolist()
+    return result
+
+
+def validate_model(model: ObjModel) -> Dict:
+    # every index the OBJ export follows is checked against the list it points into, all face groups at once
+    errors, warnings = [], []
+    for check, values in (('non_finite_vertices', model.vertices), ('non_finite_normals', model.surface_normals),
+                          ('non_finite_uvs', model.texture_coord_list)):
+        bad = np.flatnonzero(~np.isfinite(values).all(axis=1))
+        if len(bad):
+            errors.append(issue(check, bad))
+
+    groups = model.face_groups
+    lengths = np.array([len(f.vertex_chain) for f in groups], dtype=np.int64)
+    bad = np.flatnonzero(lengths % 3)
+    if len(bad):
+        errors.append(issue('chain_length', lengths[bad], face_groups=bad))
+    materials = np.array([f.material_index for f in groups], dtype=np.int64)
+    bad = np.flatnonzero((materials < 0) | (materials >= len(model.materials)))
+    if len(bad):
+        errors.append(issue('material_index', materials[bad], len(model.materials), bad))
+
+    chain = np.concatenate([f.vertex_chain.astype(np.int64) for f in groups]) if groups else np.zeros(0, np.int64)
+    group_of = np.repeat(np.arange(len(groups)), lengths)
+    batch_count = min(len(model.vertex_batch_list), len(model.texture_batch_list))
+    bad = chain >= batch_count
+    if bad.any():
+        errors.append(issue('chain_index', chain[bad], batch_count, group_of[bad]))
+
+    # the batch entries the chains reach, each checked once. A mask instead of np.unique keeps this linear
+    used = np.zeros(batch_count, dtype=bool)
+    used[chain[~bad]] = True
+    batch = np.flatnonzero(used)
+    vertex = model.vertex_batch_list[batch].astype(np.int64)
+    uv = model.texture_batch_list[batch].astype(np.int64)
+
+    def batch_issue(check, values, limit):
+        bad_entries = values >= limit
+        if bad_entries.any():
+            face_groups = group_of[np.isin(chain, batch[bad_entries])]
+            errors.append(issue(check, values[bad_entries], limit, face_groups))
+        return ~bad_entries
+
+    batch_issue('vertex_index', vertex, len(model.vertices))
+    has_normal = batch_issue('vertex_normal_index', vertex, len(model.vertex_normals))
+    normal = model.vertex_normals[vertex[has_normal]].astype(np.int64)
+    bad = normal >= len(model.surface_normals)
+    if bad.any():
+        errors.append(issue('normal_index', normal[bad], len(model.surface_normals),
+                            group_of[np.isin(chain, batch[has_normal][bad])]))
+    batch_issue('uv_index', uv, len(model.texture_coord_list))
+
+    # triangles are only formed once every index is known to be valid, zero area counts as degenerate
+    if not errors and len(chain):
+        corners = model.vertices[model.vertex_batch_list[chain]].reshape(-1, 3, 3)
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        degenerate = np.flatnonzero(~normals.any(axis=1))
+        if len(degenerate):
+            warnings.append(issue('degenerate_triangles', degenerate, face_groups=group_of[degenerate * 3]))
+    return {'errors': errors, 'warnings': warnings}
+
+
+def format_issue(name: str, found: Dict) -> str:
+    text = f"{name}: {found['count']} {CHECKS[found['check']]}"
+    if 'limit' in found:
+        text += f", up to {found['max']} with {found['limit']} entries"
+    if 'face_groups' in found:
+        groups = found['face_groups']
+        text += f" in face group{'s' if len(groups) > 1 else ''} {', '.join(map(str, groups[:10]))}"
+        if len(groups) > 10:
+            text += f" and {len(groups) - 10} more"
+    return text
+
+
+def validate_file(source: str) -> Dict:
+    # report of every mesh of a .3db or .cmp, a file that cannot even be loaded gets an error instead
+    record = {'file': os.path.abspath(source), 'meshes': [], 'error': None}
+    try:
+        tree = UtfFile().load_utf_file(source, use_mmap=True)['\\']
+        if source.lower().endswith('.cmp'):
+            meshes = [(k, v['openFLAME 3D N-mesh']) for k, v in tree.items() if k.endswith('.3db')]
+        else:
+            meshes = [(os.path.basename(source), tree['openFLAME 3D N-mesh'])]
+        for name, mesh in meshes:
+            g = ObjModel()
+            g.load_mesh(mesh)
+            record['meshes'].append({'name': name, **validate_model(g)})
+    except Exception as ex:
+        record['error'] = f"{type(ex).__name__}: {ex}"
+    record['valid'] = record['error'] is None and not any(x['errors'] for x in record['meshes'])
+    return record
+
+
+def report_lines(record: Dict) -> List[str]:
+    if record['error']:
+        return [f"{record['file']}: {record['error']}"]
+    return [format_issue(f"{record['file']} {mesh['name']}", found) for mesh in record['meshes']
+            for found in mesh['errors'] + mesh['warnings']]
+
+
+def validate_batch(inputs: List[str], report_path: str = None, jobs: int = None) -> Dict:
+    sources = [source for source, _ in find_sources(inputs)]
+    start = time.perf_counter()
+    records = list(run_jobs(validate_file, [(x,) for x in sources], jobs, chunksize=8))
+    for record in records:
+        for line in report_lines(record):
+            print(line)
+
+    elapsed = time.perf_counter() - start
+    invalid = sum(not x['valid'] for x in records)
+    warned = sum(any(mesh['warnings'] for mesh in x['meshes']) for x in records)
+    summary = {'files': len(records), 'invalid': invalid, 'with_warnings': warned, 'seconds': elapsed}
+    print(f"Validated {len(records)} files in {elapsed:.2f}s, {invalid} invalid, {warned} with warnings")
+    if report_path:
+        with open(report_path, "w") as outfile:
+            json.dump({'summary': summary, 'files': records}, outfile, indent=1)
+    return summary
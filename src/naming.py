@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+
+# --compress choices and the extension they add to OBJ outputs
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def is_compressed(output_filename: str) -> bool:
+    return os.path.splitext(output_filename)[1].lower() in COMPRESSION_EXTENSIONS.values()
+
+
+def compressed_output(output_filename: str, compression: str) -> str:
+    # adds the extension of the chosen compression unless the name already has one
+    if is_compressed(output_filename):
+        return output_filename
+    return output_filename + COMPRESSION_EXTENSIONS[compression]
+
+
+def output_format_for(output_filename):
+    # the output format follows the extension of the output file, OBJ for anything unknown. A compression extension
+    # is skipped, model.obj.gz is an OBJ
+    if is_compressed(output_filename):
+        output_filename = os.path.splitext(output_filename)[0]
+    extension = output_filename.lower().split(".")[-1]
+    if extension in ("glb", "npz", "npy"):
+        return extension
+    return "obj"
+
+
+def default_output_name(filename, extension="obj"):
+    temp = filename.split(".")
+    temp[-1] = extension
+    return ".".join(temp)
+
+
+def default_material_name(filename):
+    temp = filename.split(".")
+    temp[-1] = "mtl"
+    return ".".join(temp)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import json
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+from obj_generator import ObjModel
+from prisData import PartHierarchy
+from cache import file_hash
+
+FORMAT_VERSION = 1
+
+
+def model_arrays(model: ObjModel) -> Dict[str, np.ndarray]:
+    # the vertex chains of all face groups are stored back to back, group i is
+    # vertex_chain[face_group_offsets[i]:face_group_offsets[i + 1]]
+    chains = [face_group.vertex_chain for face_group in model.face_groups]
+    offsets = np.zeros(len(chains) + 1, dtype="<u4")
+    np.cumsum([len(x) for x in chains], out=offsets[1:])
+    return {
+        'vertices': model.vertices,
+        'normals': model.surface_normals,
+        'uvs': model.texture_coord_list,
+        'vertex_batch_list': model.vertex_batch_list,
+        'texture_batch_list': model.texture_batch_list,
+        'vertex_normals': model.vertex_normals,
+        'vertex_chain': np.concatenate(chains).astype("<u4") if chains else np.zeros(0, dtype="<u4"),
+        'face_group_offsets': offsets,
+        'material_indices': np.array([x.material_index for x in model.face_groups], dtype="<u4"),
+    }
+
+
+def collect_arrays(meshes: List[Tuple[str, ObjModel]], hierarchy: PartHierarchy = None) \
+        -> Tuple[Dict[str, np.ndarray], Dict]:
+    # array names are prefixed with the part name for .cmp files, a single .3db keeps them unprefixed
+    arrays = {}
+    parts = {}
+    for filename, model in meshes:
+        name = filename.split(".")[0]
+        prefix = f"{name}/" if hierarchy is not None else ""
+        part_arrays = model_arrays(model)
+        if hierarchy is not None:
+            part_arrays['world_transform'] = hierarchy.file_transform(filename)
+        for key, value in part_arrays.items():
+            arrays[prefix + key] = value
+        parts[name] = {
+            'prefix': prefix,
+            'vertices': len(model.vertices),
+            'normals': len(model.surface_normals),
+            'uvs': len(model.texture_coord_list),
+            'batch_vertices': len(model.vertex_batch_list),
+            'triangles': int(sum(len(x.vertex_chain) for x in model.face_groups) // 3),
+            'face_groups': len(model.face_groups),
+            'materials': [x.name for x in model.materials],
+        }
+    return arrays, parts
+
+
+def header(source: str, scale: float, arrays: Dict[str, np.ndarray], parts: Dict) -> Dict:
+    return {
+        'format_version': FORMAT_VERSION,
+        'source': os.path.basename(source),
+        'source_hash': file_hash(source),
+        'scale': scale,
+        'parts': parts,
+        'arrays': {key: {'dtype': value.dtype.str, 'shape': list(value.shape)} for key, value in arrays.items()},
+    }
+
+
+def export_to_npz(meshes: List[Tuple[str, ObjModel]], path, source: str, scale=1,
+                  hierarchy: PartHierarchy = None) -> List[str]:
+    # uncompressed archive plus a JSON header next to it
+    arrays, parts = collect_arrays(meshes, hierarchy)
+    with open(path, "wb") as outfile:
+        np.savez(outfile, **arrays)
+    header_path = os.path.splitext(path)[0] + ".json"
+    with open(header_path, "w") as outfile:
+        json.dump(header(source, scale, arrays, parts), outfile, indent=1)
+    return [path, header_path]
+
+
+def export_to_npy_dir(meshes: List[Tuple[str, ObjModel]], path, source: str, scale=1,
+                      hierarchy: PartHierarchy = None) -> List[str]:
+    # one .npy per array in the directory named like the output without its extension, they can be opened with
+    # np.load(..., mmap_mode='r'). Parts of a .cmp get a subdirectory each
+    directory = os.path.splitext(path)[0]
+    arrays, parts = collect_arrays(meshes, hierarchy)
+    written = []
+    for key, value in arrays.items():
+        array_path = os.path.join(directory, *key.split("/")) + ".npy"
+        os.makedirs(os.path.dirname(array_path), exist_ok=True)
+        np.save(array_path, np.ascontiguousarray(value))
+        written.append(array_path)
+    header_path = os.path.join(directory, "header.json")
+    with open(header_path, "w") as outfile:
+        json.dump(header(source, scale, arrays, parts), outfile, indent=1)
+    written.append(header_path)
+    return written
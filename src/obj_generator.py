@@ -1,7 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 from filereader3db import *
+import io
 import os
+import re
+import gzip
+from contextlib import contextmanager
+from typing import Optional
 import numpy as np
 
 
@@ -9,15 +14,9 @@ class Vertex:
     def __init__(self, x, y, z):
         self.vertices = np.array([x, y, z, 1])
 
-    def scale_vertex(self, scale):
-        identity = np.identity(4)
-        for i in range(3):
-            identity[i][i] = scale
-
-        self.vertices = identity.dot(self.vertices)
-
-    def get_formatted_vertex_list(self):
-        return f"{format(self.vertices[0], 'f')} {format(self.vertices[1], 'f')} {format(self.vertices[2], 'f')} "
+    def get_formatted_vertex_list(self, precision: int = None):
+        return f"{format_float(self.vertices[0], precision)} {format_float(self.vertices[1], precision)} " \
+               f"{format_float(self.vertices[2], precision)} "
 
     def __str__(self):
         return f"Vertex X={self.vertices[0]} Y={self.vertices[1]} Z={self.vertices[2]}"
@@ -25,24 +24,17 @@ class Vertex:
     def __repr__(self):
         return f"Vertex X={self.vertices[0]} Y={self.vertices[1]} Z={self.vertices[2]}"
 
-    def translate(self, matrix: np.ndarray):
-        self.vertices = matrix.dot(self.vertices)
-
-
-class TextureCoords:
 
-    def __init__(self, u, v):
-        self.u = u
-        self.v = v
+def material_name(node_name: str) -> str:
+    return node_name.replace(" ", "_").replace("#", "_")
 
-    def get_formatted_texture_coord_list(self):
-        return f"{format(self.u, 'f')} {format(self.v, 'f')}"
 
-    def __str__(self):
-        return f"TextureCoord U={self.u} V={self.v}"
-
-    def __repr__(self):
-        return f"TextureCoord U={self.u} V={self.v}"
+def texture_maps(map_name: str) -> Optional[Tuple[str, str]]:
+    # colour and bump texture file names derived from the diffuse map name, None if the name has no extension
+    basename = map_name.split(".")
+    if len(basename) > 1:
+        return basename[0] + "_color.tga", basename[0] + "_bump.tga"
+    return None
 
 
 class Material:
@@ -55,15 +47,13 @@ class Material:
             self.shininess = self.get_constant(material['Shininess'])[0]
         else:
             self.shininess = None
-        self.name = str(material['name']).replace(" ", "_").replace("#", "_")
+        self.name = material_name(str(material['name']))
         self.id = get_as_int_list(material['Material identifier']['value'])[0]
         self.has_texture = False
         if 'Map' in material['Diffuse']:
-            basename = get_as_string(material['Diffuse']['Map']['Name']['value']).split(".")
-            if len(basename) > 1:
-                filename = basename[0]
-                self.diffuse_map = filename + "_color.tga"
-                self.bump_map = filename + "_bump.tga"
+            maps = texture_maps(get_as_string(material['Diffuse']['Map']['Name']['value']))
+            if maps is not None:
+                self.diffuse_map, self.bump_map = maps
                 self.has_texture = True
 
     def get_constant(self, material):
@@ -76,25 +66,96 @@ class Material:
 class FaceGroup:
 
     def __init__(self, face_group):
-        self.vertex_chain = get_as_int_list(face_group['Face vertex chain']['value'])
+        self.vertex_chain = get_as_int_array(face_group['Face vertex chain']['value'])
         self.material_index = get_as_int_list(face_group['Material']['value'])[0]
 
 
+def transform_matrix(scale=1, translation_matrix=None) -> np.ndarray:
+    # scale applied after the part transform, fused into a single matrix
+    matrix = np.identity(4)
+    for i in range(3):
+        matrix[i][i] = scale
+    if translation_matrix is not None:
+        matrix = matrix.dot(translation_matrix)
+    return matrix
+
+
+# rows formatted per write call
+CHUNK_ROWS = 16384
+
+# zeros after the last significant decimal, with the point if nothing is left behind it
+TRAILING_ZEROS = re.compile(r"(\.\d*?)0+(?=[ \n]|$)")
+BARE_POINT = re.compile(r"\.(?=[ \n]|$)")
+NEGATIVE_ZERO = re.compile(r"(?<![\d.])-0(?=[ \n]|$)")
+
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+
+def trim_zeros(text: str) -> str:
+    # 1.500 -> 1.5, 2.000 -> 2, -0.000 -> 0, integers are left alone
+    return NEGATIVE_ZERO.sub("0", BARE_POINT.sub("", TRAILING_ZEROS.sub(r"\1", text)))
+
+
+def format_float(value, precision: int = None) -> str:
+    # the default is format(x, 'f'), six decimals with the zeros kept
+    if precision is None:
+        return format(value, 'f')
+    return trim_zeros(format(value, f".{precision}f"))
+
+
+def write_rows(outfile, row_format: str, rows: np.ndarray, precision: int = None):
+    # %-formats a whole chunk of rows at once, '%f' gives the same text as format(x, 'f')
+    if precision is not None:
+        row_format = row_format.replace("%f", f"%.{precision}f")
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS]
+        text = (row_format * len(chunk)) % tuple(chunk.ravel().tolist())
+        outfile.write(text if precision is None else trim_zeros(text))
+
+
+def split_compression(path: str) -> Tuple[str, str]:
+    # model.obj.gz -> (model.obj, .gz)
+    for extension in COMPRESSED_EXTENSIONS:
+        if path.lower().endswith(extension):
+            return path[:-len(extension)], path[-len(extension):]
+    return path, ""
+
+
+@contextmanager
+def open_output(path: str):
+    # text file for the OBJ, gzip or zstd compressed on the fly when the name ends in .gz or .zst
+    compression = split_compression(path)[1].lower()
+    if compression == ".gz":
+        # no time stamp in the header, the same model always gives the same bytes
+        with open(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as compressed, \
+                io.TextIOWrapper(compressed) as outfile:
+            yield outfile
+    elif compression == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd output needs the zstandard package (pip install zstandard)") from None
+        with open(path, "wb") as raw, zstandard.ZstdCompressor().stream_writer(raw, closefd=False) as compressed, \
+                io.TextIOWrapper(compressed) as outfile:
+            yield outfile
+    else:
+        with open(path, "w") as outfile:
+            yield outfile
+
+
 class ObjModel:
 
     def __init__(self):
-        self.vertices = []
-        self.face_groups = []
-        self.surface_normals = []
-        self.vertex_batch_list = []
-        self.texture_coord_list = []
-        self.vertex_normals = []
-        self.texture_batch_list = []
+        self.vertices = np.empty((0, 3), dtype=np.float32)
+        self.face_groups: List[FaceGroup] = []
+        self.surface_normals = np.empty((0, 3), dtype=np.float32)
+        self.vertex_batch_list = np.empty(0, dtype=np.uint32)
+        self.texture_coord_list = np.empty((0, 2), dtype=np.float32)
+        self.vertex_normals = np.empty(0, dtype=np.uint32)
+        self.texture_batch_list = np.empty(0, dtype=np.uint32)
         self.materials: List[Material] = []
 
-    def export_to_obj(self, mesh, path, scale=1, translation_matrix=np.identity(4)):
-        # mesh = self.model['\\']['openFLAME 3D N-mesh']
-
+    def load_mesh(self, mesh, shared_materials: Dict[str, Material] = None):
         self.create_vertices(mesh)
 
         self.create_face_groups(mesh)
@@ -103,77 +164,79 @@ class ObjModel:
 
         self.create_texture_coordinates(mesh)
 
-        self.vertex_batch_list = get_as_int_list(mesh['Vertices']['Vertex batch list']['value'])
+        self.vertex_batch_list = get_as_int_array(mesh['Vertices']['Vertex batch list']['value'])
+
+        self.create_materials(mesh, shared_materials)
+
+    def transformed_vertices(self, scale=1, translation_matrix=None) -> np.ndarray:
+        # one batched multiply for all vertices, w is always 1 so the last column is added as the offset
+        matrix = transform_matrix(scale, translation_matrix)
+        return np.matmul(self.vertices, matrix[:3, :3].T) + matrix[:3, 3]
 
+    def face_indices(self, face_group: FaceGroup, offsets=(0, 0, 0)) -> np.ndarray:
+        # one row per triangle: vertex/uv/normal indices of the three corners, 1 based and shifted by the
+        # vertex/uv/normal counts of the objects written before this one
+        chain = face_group.vertex_chain.astype(np.int64)
+        vertex = self.vertex_batch_list[chain].astype(np.int64)
+        uv = self.texture_batch_list[chain]
+        normal = self.vertex_normals[vertex]
+        return (np.stack((vertex, uv, normal), axis=1) + 1 + np.array(offsets)).reshape(-1, 9)
+
+    def export_to_obj(self, mesh, path, scale=1, translation_matrix=None):
+        # mesh = self.model['\\']['openFLAME 3D N-mesh']
+
+        self.load_mesh(mesh)
+        return self.write_files(path, scale, translation_matrix)
+
+    def write_files(self, path, scale=1, translation_matrix=None, precision: int = None):
+        # OBJ and MTL of an already loaded model, the MTL is never compressed so mtllib can name it as it is
         basename = str(os.path.basename(path)).split(".")[0]
         material_filename = basename + ".mtl"
-        self.create_materials(mesh)
 
-        with open(path, "w") as outfile:
-            outfile.write(f"mtllib {material_filename}\n\n")
-            for vertex in self.vertices:
-                vertex.translate(translation_matrix)
-                vertex.scale_vertex(scale)
-                s = "v " + vertex.get_formatted_vertex_list()
-                outfile.write(s + "\n")
-
-            outfile.write(f"#{len(self.vertices)} Vertices \n\n")
-
-            for texture_coord in self.texture_coord_list:
-                s = "vt " + texture_coord.get_formatted_texture_coord_list()
-                outfile.write(s + "\n")
-            outfile.write(f"#{len(self.texture_coord_list)} Texture Coordinates \n\n")
-
-            for vertex in self.surface_normals:
-                s = "vn " + vertex.get_formatted_vertex_list()
-                outfile.write(s + "\n")
-
-            outfile.write(f"#{len(self.surface_normals)} Normals \n\n")
-
-            triangles = 0
-            outfile.write(f"o {basename}\n")
-            for face_group_index in range(len(self.face_groups)):
-                face_group: FaceGroup = self.face_groups[face_group_index]
-                chain = face_group.vertex_chain
-                outfile.write(f"g FaceGroup{face_group_index}\n")
-                outfile.write(f"usemtl {self.materials[face_group.material_index].name}\n")
-                for i, index in enumerate(range(0, len(chain), 3)):
-                    vertex_1 = self.vertex_batch_list[chain[index]] + 1
-                    vertex_2 = self.vertex_batch_list[chain[index + 1]] + 1
-                    vertex_3 = self.vertex_batch_list[chain[index + 2]] + 1
-                    uv_1 = self.texture_batch_list[chain[index]] + 1
-                    uv_2 = self.texture_batch_list[chain[index + 1]] + 1
-                    uv_3 = self.texture_batch_list[chain[index + 2]] + 1
-                    normal_1 = self.vertex_normals[vertex_1 - 1] + 1
-                    normal_2 = self.vertex_normals[vertex_2 - 1] + 1
-                    normal_3 = self.vertex_normals[vertex_3 - 1] + 1
-                    outfile.write(
-                        f"f {vertex_1}/{uv_1}/{normal_1} {vertex_2}/{uv_2}/{normal_2} {vertex_3}/{uv_3}/{normal_3} \n")
-                    triangles += 1
-
-            outfile.write("#%d Faces" % triangles)
-
-        with open(os.path.join(os.path.dirname(path), material_filename), "w") as outfile:
-            for mat in self.materials:
-                outfile.write(f"newmtl {mat.name}\n")
-                outfile.write(f"Ka {mat.ambient.get_formatted_vertex_list()}\n")
-                outfile.write(f"Kd {mat.diffuse.get_formatted_vertex_list()}\n")
-                outfile.write(f"Ks {mat.specular.get_formatted_vertex_list()}\n")
-                outfile.write(f"illum 2\n")
-                if mat.shininess:
-                    outfile.write(f"Ns {mat.shininess * 50}\n")
-
-                if mat.has_texture:
-                    outfile.write(f"map_Kd {mat.diffuse_map}\n")
-                    outfile.write(f"map_Bump {mat.bump_map}\n")
-
-                outfile.write("\n")
+        with open_output(path) as outfile:
+            self.write_obj(outfile, basename, material_filename, self.transformed_vertices(scale, translation_matrix),
+                           precision)
+
+        material_path = os.path.join(os.path.dirname(path), material_filename)
+        with open(material_path, "w") as outfile:
+            self.write_mtl(outfile, precision)
+
+        return [path, material_path]
+
+    def write_obj(self, outfile, basename, material_filename, vertices, precision: int = None):
+        outfile.write(f"mtllib {material_filename}\n\n")
+        self.write_vertex_data(outfile, vertices, precision)
+        triangles = self.write_faces(outfile, basename)
+        outfile.write("#%d Faces" % triangles)
+
+    def write_vertex_data(self, outfile, vertices, precision: int = None):
+        write_rows(outfile, "v %f %f %f \n", vertices, precision)
+        outfile.write(f"#{len(vertices)} Vertices \n\n")
+
+        write_rows(outfile, "vt %f %f\n", self.texture_coord_list, precision)
+        outfile.write(f"#{len(self.texture_coord_list)} Texture Coordinates \n\n")
+
+        write_rows(outfile, "vn %f %f %f \n", self.surface_normals, precision)
+        outfile.write(f"#{len(self.surface_normals)} Normals \n\n")
+
+    def write_faces(self, outfile, object_name, offsets=(0, 0, 0), group_prefix="") -> int:
+        triangles = 0
+        outfile.write(f"o {object_name}\n")
+        for face_group_index, face_group in enumerate(self.face_groups):
+            outfile.write(f"g {group_prefix}FaceGroup{face_group_index}\n")
+            outfile.write(f"usemtl {self.materials[face_group.material_index].name}\n")
+            faces = self.face_indices(face_group, offsets)
+            write_rows(outfile, "f %d/%d/%d %d/%d/%d %d/%d/%d \n", faces)
+            triangles += len(faces)
+        return triangles
+
+    def write_mtl(self, outfile, precision: int = None):
+        for mat in self.materials:
+            write_material(outfile, mat, precision)
 
     def create_normals(self, mesh):
-        data = get_as_float_list(mesh['Normals']['Surface normal list']['value'])
-        for i in range(0, len(data), 3):
-            self.surface_normals.append(Vertex(float(data[i]), float(data[i + 1]), float(data[i + 2])))
-        self.vertex_normals = get_as_int_list(mesh['Vertices']['Vertex normal']['value'])
+        self.surface_normals = get_as_float_array(mesh['Normals']['Surface normal list']['value'], 3)
+        self.vertex_normals = get_as_int_array(mesh['Vertices']['Vertex normal']['value'])
 
     def create_face_groups(self, mesh):
         face_group_count = get_as_int_list(mesh['Face groups']['Count']['value'])[0]
@@ -182,18 +245,75 @@ class ObjModel:
             self.face_groups.append(FaceGroup(face_group))
 
     def create_vertices(self, mesh):
-        data = get_as_float_list(mesh['Vertices']['Object vertex list']['value'])
-        for i in range(0, len(data), 3):
-            self.vertices.append(Vertex(float(data[i]), float(data[i + 1]), float(data[i + 2])))
-        self.texture_batch_list = get_as_int_list(mesh['Vertices']['Texture batch list']['value'])
+        self.vertices = get_as_float_array(mesh['Vertices']['Object vertex list']['value'], 3)
+        self.texture_batch_list = get_as_int_array(mesh['Vertices']['Texture batch list']['value'])
 
     def create_texture_coordinates(self, mesh):
-        data = get_as_float_list(mesh['Vertices']['Texture vertex list']['value'])
-        for i in range(0, len(data), 2):
-            self.texture_coord_list.append(TextureCoords(float(data[i]), float(data[i + 1])))
+        self.texture_coord_list = get_as_float_array(mesh['Vertices']['Texture vertex list']['value'], 2)
 
-    def create_materials(self, mesh):
+    def create_materials(self, mesh, shared_materials: Dict[str, Material] = None):
+        # materials already parsed for another part of the same model are reused by node name
         material_lib = mesh['Material library']
         for key in material_lib.keys():
             if key not in ['name', 'value', 'text', 'Material count']:
-                self.materials.append(Material(material_lib[key]))
+                if shared_materials is None:
+                    self.materials.append(Material(material_lib[key]))
+                    continue
+                if key not in shared_materials:
+                    shared_materials[key] = Material(material_lib[key])
+                self.materials.append(shared_materials[key])
+
+
+def write_material(outfile, mat: Material, precision: int = None):
+    outfile.write(f"newmtl {mat.name}\n")
+    outfile.write(f"Ka {mat.ambient.get_formatted_vertex_list(precision)}\n")
+    outfile.write(f"Kd {mat.diffuse.get_formatted_vertex_list(precision)}\n")
+    outfile.write(f"Ks {mat.specular.get_formatted_vertex_list(precision)}\n")
+    outfile.write(f"illum 2\n")
+    if mat.shininess:
+        outfile.write(f"Ns {mat.shininess * 50}\n")
+
+    if mat.has_texture:
+        outfile.write(f"map_Kd {mat.diffuse_map}\n")
+        outfile.write(f"map_Bump {mat.bump_map}\n")
+
+    outfile.write("\n")
+
+
+def export_merged_obj(parts: List[Tuple[str, ObjModel, np.ndarray]], path, scale=1, precision: int = None) -> List[str]:
+    # writes every (object name, loaded model, part transform) into one OBJ with one object per part, face indices
+    # continue across the parts, materials with the same name are written to the MTL once
+    basename = str(os.path.basename(path)).split(".")[0]
+    material_filename = basename + ".mtl"
+
+    with open_output(path) as outfile:
+        write_merged_obj(outfile, parts, material_filename, scale, precision)
+
+    material_path = os.path.join(os.path.dirname(path), material_filename)
+    with open(material_path, "w") as outfile:
+        write_merged_mtl(outfile, parts, precision)
+
+    return [path, material_path]
+
+
+def write_merged_obj(outfile, parts: List[Tuple[str, ObjModel, np.ndarray]], material_filename: str, scale=1,
+                     precision: int = None):
+    outfile.write(f"mtllib {material_filename}\n\n")
+    offsets = np.zeros(3, dtype=np.int64)
+    triangles = 0
+    for object_name, model, translation_matrix in parts:
+        vertices = model.transformed_vertices(scale, translation_matrix)
+        model.write_vertex_data(outfile, vertices, precision)
+        triangles += model.write_faces(outfile, object_name, offsets, object_name + "_")
+        outfile.write("\n")
+        offsets += (len(vertices), len(model.texture_coord_list), len(model.surface_normals))
+    outfile.write("#%d Faces" % triangles)
+
+
+def write_merged_mtl(outfile, parts: List[Tuple[str, ObjModel, np.ndarray]], precision: int = None):
+    materials: Dict[str, Material] = {}
+    for _, model, _ in parts:
+        for mat in model.materials:
+            materials.setdefault(mat.name, mat)
+    for mat in materials.values():
+        write_material(outfile, mat, precision)
@@ -1,10 +1,37 @@
-from typing import List
+from typing import List, Dict, Optional
 import numpy as np
 
-from filereader3db import get_string, get_as_float_list, get_float
+
+# one 0xD0 byte record of the Cons/Pris and Cons/Rev nodes
+PART_DTYPE = np.dtype([
+    ('parent_name', 'S64'),
+    ('child_name', 'S64'),
+    ('origin', '<f4', (3,)),
+    ('offset', '<f4', (3,)),
+    ('rotation', '<f4', (3, 3)),
+    ('axis', '<f4', (3,)),
+    ('min', '<f4'),
+    ('max', '<f4'),
+])
+
+
+def decode_name(raw: bytes) -> str:
+    # names are NUL terminated within the first 0x3f bytes, the rest of the field is garbage
+    return raw[:0x3f].split(b"\0", 1)[0].decode("ascii")
+
+
+def trans_mats(records: np.ndarray) -> np.ndarray:
+    # same layout as Part.trans_mat() for every record at once
+    matrices = np.zeros((len(records), 4, 4))
+    matrices[:, :3, :3] = records['rotation']
+    matrices[:, :3, 3] = records['origin']
+    return matrices
 
 
 class Part:
+    __slots__ = ('parent_name', 'child_name', 'origin_x', 'origin_y', 'origin_z', 'offset_x', 'offset_y', 'offset_z',
+                 'rot_mat_xx', 'rot_mat_xy', 'rot_mat_xz', 'rot_mat_yx', 'rot_mat_yy', 'rot_mat_yz',
+                 'rot_mat_zx', 'rot_mat_zy', 'rot_mat_zz', 'axis_rot_x', 'axis_rot_y', 'axis_rot_z', 'min', 'max')
 
     def __init__(self):
         self.parent_name: str = ''
@@ -55,49 +82,109 @@ class Part:
 class CmpPartData:
 
     def __init__(self, inputData: dict):
+        data = inputData['value']
+        num_parts = len(data) // PART_DTYPE.itemsize
+        self.records: np.ndarray = np.frombuffer(data, dtype=PART_DTYPE, count=num_parts)
         self.parts: List[Part] = []
-        data: bytearray = inputData['value']
-        pos: int = 0
-        num_parts = len(data) // 0xD0
-        for count in range(num_parts):
+
+        parent_names = [decode_name(x) for x in self.records['parent_name'].tolist()]
+        child_names = [decode_name(x) for x in self.records['child_name'].tolist()]
+        origins = self.records['origin'].tolist()
+        offsets = self.records['offset'].tolist()
+        rotations = self.records['rotation'].reshape(-1, 9).tolist()
+        axes = self.records['axis'].tolist()
+        limits = zip(self.records['min'].tolist(), self.records['max'].tolist())
+        for parent_name, child_name, origin, offset, rotation, axis, (min_value, max_value) in \
+                zip(parent_names, child_names, origins, offsets, rotations, axes, limits):
             part = Part()
-            index = data.find(0, pos, 0x40) - pos
-            if index < 0 or index > 0x3f:
-                index = 0x3f
-            part.parent_name, _ = get_string(data, pos, index)
-            pos += 0x40
-
-            index = data.find(0, pos, 0x40) - pos
-            if index < 0 or index > 0x3f:
-                index = 0x3f
-            part.child_name, _ = get_string(data, pos, index)
-            pos += 0x40
-
-            part.origin_x, pos = get_float(data, pos)
-            part.origin_y, pos = get_float(data, pos)
-            part.origin_z, pos = get_float(data, pos)
-
-            part.offset_x, pos = get_float(data, pos)
-            part.offset_y, pos = get_float(data, pos)
-            part.offset_z, pos = get_float(data, pos)
-
-            part.rot_mat_xx, pos = get_float(data, pos)
-            part.rot_mat_xy, pos = get_float(data, pos)
-            part.rot_mat_xz, pos = get_float(data, pos)
-
-            part.rot_mat_yx, pos = get_float(data, pos)
-            part.rot_mat_yy, pos = get_float(data, pos)
-            part.rot_mat_yz, pos = get_float(data, pos)
-
-            part.rot_mat_zx, pos = get_float(data, pos)
-            part.rot_mat_zy, pos = get_float(data, pos)
-            part.rot_mat_zz, pos = get_float(data, pos)
-
-            part.axis_rot_x, pos = get_float(data, pos)
-            part.axis_rot_y, pos = get_float(data, pos)
-            part.axis_rot_z, pos = get_float(data, pos)
-
-            part.min, pos = get_float(data, pos)
-            part.max, pos = get_float(data, pos)
+            part.parent_name = parent_name
+            part.child_name = child_name
+            part.origin_x, part.origin_y, part.origin_z = origin
+            part.offset_x, part.offset_y, part.offset_z = offset
+            part.rot_mat_xx, part.rot_mat_xy, part.rot_mat_xz, \
+                part.rot_mat_yx, part.rot_mat_yy, part.rot_mat_yz, \
+                part.rot_mat_zx, part.rot_mat_zy, part.rot_mat_zz = rotation
+            part.axis_rot_x, part.axis_rot_y, part.axis_rot_z = axis
+            part.min = min_value
+            part.max = max_value
             self.parts.append(part)
 
+    def trans_mats(self) -> np.ndarray:
+        return trans_mats(self.records)
+
+
+class PartHierarchy:
+
+    def __init__(self, parts: List[Part], root_names=("Root",), transforms: np.ndarray = None):
+        self.parts = parts
+        if transforms is None:
+            transforms = np.array([part.trans_mat() for part in parts]).reshape(-1, 4, 4)
+        self.transforms = transforms
+        # the first part with a given child name wins, same as a linear search would
+        self.index: Dict[str, int] = {}
+        for i, part in enumerate(parts):
+            self.index.setdefault(part.child_name, i)
+        self.root_names = set(root_names)
+        self.missing_parents: List[str] = []
+        self.world_transforms: Dict[str, np.ndarray] = {}
+        self.resolve()
+
+    def part(self, name: str) -> Optional[Part]:
+        i = self.index.get(name)
+        return self.parts[i] if i is not None else None
+
+    def resolve(self):
+        # walks up from every part until an already resolved ancestor or a root, then fills in the chain top down
+        world = self.world_transforms
+        for name in self.index:
+            chain: List[int] = []
+            on_chain = set()
+            current = self.part(name)
+            base = None
+            while base is None:
+                if current.child_name in world:
+                    base = world[current.child_name]
+                    break
+                if current.child_name in on_chain:
+                    cycle = " -> ".join(self.parts[i].child_name for i in chain)
+                    raise ValueError(f"Cycle in part hierarchy: {cycle}")
+                chain.append(self.index[current.child_name])
+                on_chain.add(current.child_name)
+                parent = self.part(current.parent_name)
+                if parent is None:
+                    if current.parent_name not in self.root_names and current.parent_name not in self.missing_parents:
+                        self.missing_parents.append(current.parent_name)
+                    base = np.identity(4)
+                else:
+                    current = parent
+            for i in reversed(chain):
+                base = np.matmul(self.transforms[i], base)
+                world[self.parts[i].child_name] = base
+
+    def part_for_file(self, filename: str) -> Optional[Part]:
+        # first part whose child name is a prefix of the file name
+        found = [self.index[filename[:i]] for i in range(len(filename) + 1) if filename[:i] in self.index]
+        return self.parts[min(found)] if found else None
+
+    def file_transform(self, filename: str) -> np.ndarray:
+        part = self.part_for_file(filename)
+        if part is None:
+            return np.identity(4)
+        return self.world_transforms[part.child_name]
+
+
+def decode_part_records(cons: Dict) -> (List[Part], np.ndarray):
+    # parts of the Cmpnd/Cons node and their transforms, prismatic joints first then revolute ones
+    parts: List[Part] = []
+    transforms = []
+    for key in ('Pris', 'Rev'):
+        if key in cons:
+            part_data = CmpPartData(cons[key])
+            parts.extend(part_data.parts)
+            transforms.append(part_data.trans_mats())
+    return parts, np.concatenate(transforms) if transforms else np.zeros((0, 4, 4))
+
+
+def load_part_hierarchy(cons: Dict) -> PartHierarchy:
+    parts, transforms = decode_part_records(cons)
+    return PartHierarchy(parts, transforms=transforms)
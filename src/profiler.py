@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+def bytes_written(paths: List[str]) -> int:
+    return sum(os.path.getsize(x) for x in paths if os.path.isfile(x))
+
+
+class Profiler:
+    # wall time, peak traced memory and counts of every phase, parts of a .cmp get a phase record of their own
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records: List[Dict] = []
+        self.started_tracing = False
+        self.start = None
+        self.peak_memory = 0
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_time = time.perf_counter() - self.start
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return False
+
+    @contextmanager
+    def phase(self, name: str, part: str = None):
+        # the yielded dict takes the counts of the phase
+        counts: Dict = {}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            record = {'phase': name, 'part': part, 'seconds': time.perf_counter() - start}
+            if tracing:
+                # memory allocated by the phase on top of what was already in use when it started
+                record['peak_memory'] = max(0, tracemalloc.get_traced_memory()[1] - current)
+                self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            record['counts'] = counts
+            self.records.append(record)
+
+    def totals(self) -> Dict:
+        totals: Dict[str, Dict] = {}
+        for record in self.records:
+            total = totals.setdefault(record['phase'], {'seconds': 0, 'calls': 0})
+            total['seconds'] += record['seconds']
+            total['calls'] += 1
+            if 'peak_memory' in record:
+                total['peak_memory'] = max(total.get('peak_memory', 0), record['peak_memory'])
+            for key, value in record['counts'].items():
+                total[key] = total.get(key, 0) + value
+        return totals
+
+    def report(self, **info) -> Dict:
+        return {
+            **info,
+            'wall_time': getattr(self, 'wall_time', time.perf_counter() - self.start if self.start else 0),
+            'peak_memory': self.peak_memory if self.trace_memory else None,
+            'phases': self.totals(),
+            'records': self.records,
+        }
+
+    def save(self, path: str, **info):
+        with open(path, "w") as outfile:
+            json.dump(self.report(**info), outfile, indent=2)
+
+
+class NullProfiler:
+    # stands in for a Profiler when profiling is off, every phase shares one throwaway counts dict
+
+    class NullPhase:
+        counts: Dict = {}
+
+        def __enter__(self):
+            return self.counts
+
+        def __exit__(self, *exc):
+            return False
+
+    null_phase = NullPhase()
+
+    def phase(self, name: str, part: str = None):
+        return self.null_phase
+
+
+NO_PROFILER = NullProfiler()
+
+
+class ProgressTracker:
+    # reports every phase to callback(done, total, description) before handing it to the wrapped profiler,
+    # total is set by the caller once the number of parts is known. An exception raised by the callback aborts the
+    # conversion, which is how a conversion gets cancelled
+
+    def __init__(self, callback, profiler=NO_PROFILER):
+        self.callback = callback
+        self.profiler = profiler
+        self.done = 0
+        self.total = 1
+
+    def phase(self, name: str, part: str = None):
+        self.callback(self.done, max(self.total, self.done + 1), f"{name} {part}" if part else name)
+        self.done += 1
+        return self.profiler.phase(name, part)
+
+    def finish(self):
+        self.callback(self.total, self.total, "done")
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from filereader3db import UtfFile, UtfHeader, NODE_STRUCT
+from obj_generator import ObjModel, write_merged_obj, write_merged_mtl
+from prisData import PartHierarchy, load_part_hierarchy
+from glb_generator import build_glb
+from npy_generator import collect_arrays
+from mesh_validator import validate_model, format_issue
+from cache import file_stamp
+from extractor import VERSION, precision_digits
+
+FORMATS = {
+    "obj": "text/plain; charset=utf-8",
+    "mtl": "text/plain; charset=utf-8",
+    "glb": "model/gltf-binary",
+    "npz": "application/octet-stream",
+}
+
+
+class SizedLRU:
+    # least recently used entries are dropped once the summed size of the entries goes over max_bytes, an entry
+    # larger than the whole cache is handed out but not kept
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.sizes: Dict = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        # load() returns (value, size in bytes), it runs outside the lock so a slow load does not block hits
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value, size = load()
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = value
+                self.sizes[key] = size
+                self.size += size
+                while self.size > self.max_bytes:
+                    old_key, _ = self.entries.popitem(last=False)
+                    self.size -= self.sizes.pop(old_key)
+                    self.evictions += 1
+        return value
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class LoadedFile:
+    # decoded meshes of a .3db or .cmp, models are only read after loading so requests can share them. The meshes
+    # are validated once when they are loaded, errors holds the formatted errors of every part that has any
+
+    def __init__(self, filename: str, parts: List[Tuple[str, ObjModel]], hierarchy: PartHierarchy = None):
+        self.filename = filename
+        self.parts = parts
+        self.hierarchy = hierarchy
+        self.errors: Dict[str, List[str]] = {}
+        for k, g in parts:
+            found = [format_issue(k, x) for x in validate_model(g)['errors']]
+            if found:
+                self.errors[k] = found
+
+    def transform(self, part: str):
+        return self.hierarchy.file_transform(part) if self.hierarchy is not None else None
+
+    def size(self) -> int:
+        arrays = [value for _, g in self.parts for value in vars(g).values() if isinstance(value, np.ndarray)]
+        arrays += [f.vertex_chain for _, g in self.parts for f in g.face_groups]
+        return sum(value.nbytes for value in arrays)
+
+
+class ConversionService:
+
+    def __init__(self, tree_cache_bytes: int, mesh_cache_bytes: int):
+        self.trees = SizedLRU(tree_cache_bytes)
+        self.meshes = SizedLRU(mesh_cache_bytes)
+        self.counters: Dict[str, Dict] = {}
+        self.counters_lock = threading.Lock()
+        self.started = time.time()
+
+    @staticmethod
+    def key(filename: str):
+        # a changed file gets a new key, its old entries age out of the caches
+        return os.path.abspath(filename), tuple(file_stamp(filename))
+
+    def tree(self, filename: str) -> Tuple[UtfHeader, Dict]:
+        def load():
+            utf = UtfFile()
+            tree = utf.load_utf_file(filename, use_mmap=True)
+            return (utf.read_header(utf.mapped), tree), len(utf.mapped)
+        return self.trees.get(self.key(filename), load)
+
+    def loaded(self, filename: str) -> LoadedFile:
+        def load():
+            _, tree = self.tree(filename)
+            if filename.lower().endswith('.3db'):
+                g = ObjModel()
+                g.load_mesh(tree['\\']['openFLAME 3D N-mesh'])
+                loaded = LoadedFile(filename, [(os.path.basename(filename), g)])
+            elif filename.lower().endswith('.cmp'):
+                hierarchy = load_part_hierarchy(tree['\\']['Cmpnd']['Cons'])
+                shared_materials = {}
+                parts = []
+                for k, v in tree['\\'].items():
+                    if k.endswith('.3db'):
+                        g = ObjModel()
+                        g.load_mesh(v['openFLAME 3D N-mesh'], shared_materials)
+                        parts.append((k, g))
+                loaded = LoadedFile(filename, parts, hierarchy)
+            else:
+                raise ValueError(f"Not a .3db or .cmp file: {filename}")
+            return loaded, loaded.size()
+        return self.meshes.get(self.key(filename), load)
+
+    def parts(self, filename: str, part: str = None) -> Tuple[LoadedFile, List[Tuple[str, ObjModel]]]:
+        # the parts a conversion writes, all of them or the one selected. Raises ValueError if one of them is invalid
+        loaded = self.loaded(filename)
+        parts = loaded.parts
+        if part is not None:
+            parts = [(k, g) for k, g in parts if k == part]
+            if not parts:
+                raise KeyError(f"No part {part} in {filename}")
+        errors = [error for k, _ in parts for error in loaded.errors.get(k, [])]
+        if errors:
+            raise ValueError(f"{filename} is not a valid model: " + "; ".join(errors))
+        return loaded, parts
+
+    def convert(self, outfile, filename: str, output_format: str = "obj", scale: float = 1, part: str = None,
+                precision: int = None):
+        # writes the converted model to the binary stream outfile, a .cmp becomes one merged OBJ/MTL/GLB/NPZ
+        loaded, parts = self.parts(filename, part)
+        basename = os.path.basename(filename).split(".")[0]
+        if output_format in ("obj", "mtl"):
+            merged_parts = [(k.split(".")[0], g, loaded.transform(k)) for k, g in parts]
+            text = io.TextIOWrapper(outfile, encoding="utf-8", newline="\n")
+            if loaded.hierarchy is None:
+                # a single .3db comes out exactly as the command line writes it
+                g = parts[0][1]
+                if output_format == "obj":
+                    g.write_obj(text, basename, basename + ".mtl", g.transformed_vertices(scale), precision)
+                else:
+                    g.write_mtl(text, precision)
+            elif output_format == "obj":
+                write_merged_obj(text, merged_parts, basename + ".mtl", scale, precision)
+            else:
+                write_merged_mtl(text, merged_parts, precision)
+            text.flush()
+            text.detach()
+        elif output_format == "glb":
+            build_glb(parts, basename, scale, loaded.hierarchy).write_to(outfile)
+        elif output_format == "npz":
+            arrays, _ = collect_arrays(parts, loaded.hierarchy)
+            # zip needs to seek back to patch the local headers, the archive is built in memory first
+            buffer = io.BytesIO()
+            np.savez(buffer, **arrays)
+            outfile.write(buffer.getbuffer())
+        else:
+            raise ValueError(f"Unknown format {output_format}")
+
+    def inspect(self, filename: str) -> Dict:
+        loaded = self.loaded(filename)
+        header, tree = self.tree(filename)
+        info = {
+            'file': os.path.abspath(filename),
+            'bytes': os.path.getsize(filename),
+            'nodes': header.node_size // NODE_STRUCT.size,
+            'meshes': [{'name': k, 'vertices': len(g.vertices), 'face_groups': len(g.face_groups),
+                        'faces': sum(len(f.vertex_chain) // 3 for f in g.face_groups),
+                        'materials': [mat.name for mat in g.materials]} for k, g in loaded.parts],
+        }
+        if loaded.hierarchy is not None:
+            info['parts'] = [{'name': p.child_name, 'parent': p.parent_name} for p in loaded.hierarchy.parts]
+            info['missing_parents'] = loaded.hierarchy.missing_parents
+        info['root_nodes'] = [k for k in tree['\\'] if k not in ('name', 'value', 'text')]
+        return info
+
+    def record(self, endpoint: str, seconds: float, failed: bool):
+        with self.counters_lock:
+            counter = self.counters.setdefault(endpoint, {'requests': 0, 'errors': 0, 'total_seconds': 0,
+                                                          'max_seconds': 0})
+            counter['requests'] += 1
+            counter['errors'] += failed
+            counter['total_seconds'] += seconds
+            counter['max_seconds'] = max(counter['max_seconds'], seconds)
+
+    def stats(self) -> Dict:
+        with self.counters_lock:
+            requests = {k: {**v, 'mean_seconds': v['total_seconds'] / v['requests']} for k, v in self.counters.items()}
+        return {'version': VERSION, 'uptime': time.time() - self.started, 'requests': requests,
+                'tree_cache': self.trees.stats(), 'mesh_cache': self.meshes.stats()}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # GET /convert?path=...&format=obj|mtl|glb|npz&scale=1&part=...&precision=..., GET /inspect?path=..., GET /stats
+    server_version = f"CFWExtractor/{VERSION}"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        endpoint = url.path.strip("/")
+        start = time.perf_counter()
+        failed = True
+        streaming = False
+        try:
+            if endpoint == "stats":
+                self.send_json(self.server.service.stats())
+            elif endpoint == "inspect":
+                self.send_json(self.server.service.inspect(query['path']))
+            elif endpoint == "convert":
+                output_format = query.get('format', "obj")
+                if output_format not in FORMATS:
+                    raise ValueError(f"Unknown format {output_format}")
+                filename = query['path']
+                # the parameters are checked before anything is loaded, a bad one never gets a 200
+                try:
+                    scale = float(query.get('scale', 1))
+                    if not math.isfinite(scale):
+                        raise ValueError(f"scale has to be a finite number, not {query['scale']}")
+                    precision = precision_digits(query['precision']) if 'precision' in query else None
+                except (ValueError, argparse.ArgumentTypeError) as ex:
+                    self.send_error(400, f"Bad parameter: {ex}")
+                    return
+                # everything is loaded and validated before the headers go out, so load errors and invalid meshes
+                # still get an error status
+                self.server.service.parts(filename, query.get('part'))
+                self.send_response(200)
+                self.send_header("Content-Type", FORMATS[output_format])
+                self.end_headers()
+                streaming = True
+                self.server.service.convert(self.wfile, filename, output_format, scale, query.get('part'),
+                                            precision)
+            else:
+                self.send_json({'error': f"Unknown endpoint /{endpoint}"}, 404)
+                return
+            failed = False
+        except Exception as ex:
+            if streaming:
+                # the status is already sent, the truncated body is all the client gets
+                self.log_error("%s failed while streaming: %s", self.path, ex)
+                return
+            status = 404 if isinstance(ex, (KeyError, FileNotFoundError)) else 400
+            self.send_json({'error': f"{type(ex).__name__}: {ex}"}, status)
+        finally:
+            self.server.service.record(endpoint, time.perf_counter() - start, failed)
+
+    def send_json(self, data: Dict, status: int = 200):
+        body = json.dumps(data, indent=1).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    # requests are handled on a fixed pool of threads instead of a new thread per connection
+
+    def __init__(self, address, handler, service: ConversionService, workers: int, quiet: bool = False):
+        super().__init__(address, handler)
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.quiet = quiet
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def service_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="service.py", description="Local model conversion server with warm caches")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8733)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="request handling threads")
+    parser.add_argument("--tree-cache", type=float, default=256, metavar="MB", help="size of the parsed file cache")
+    parser.add_argument("--mesh-cache", type=float, default=512, metavar="MB", help="size of the decoded mesh cache")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not log requests")
+    return parser
+
+
+def main(argv: List[str]) -> int:
+    args = service_parser().parse_args(argv)
+    service = ConversionService(int(args.tree_cache * 2 ** 20), int(args.mesh_cache * 2 ** 20))
+    server = PooledHTTPServer((args.host, args.port), ServiceHandler, service, args.workers, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/ with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import math
+from typing import Dict, List
+
+import numpy as np
+
+from prisData import PART_DTYPE
+from utf_writer import write_utf
+
+
+def int_data(*values) -> bytes:
+    return np.array(values, dtype='<i4').tobytes()
+
+
+def float_data(*values) -> bytes:
+    return np.array(values, dtype='<f4').tobytes()
+
+
+def material_node(index: int, textured: bool) -> Dict:
+    # colours cycle so the MTL does not collapse to identical lines
+    shade = (index % 10) / 10
+    diffuse = {'Constant': float_data(shade, 1 - shade, 0.5)}
+    if textured:
+        diffuse['Map'] = {'Name': f"synthetic{index}.tga".encode("ascii") + b"\0"}
+    return {
+        'Material identifier': int_data(index + 1),
+        'Diffuse': diffuse,
+        'Ambient': {'Constant': float_data(0.2, 0.2, 0.2)},
+        'Specular': {'Constant': float_data(0.5, 0.5, 0.5)},
+        'Shininess': {'Constant': float_data(0.4)},
+    }
+
+
+def mesh_node(vertex_count: int, face_groups: int = 1, materials: int = 1, textured: bool = True) -> Dict:
+    # a rippled square grid with about vertex_count vertices, its triangles split evenly into face_groups groups
+    side = max(2, int(math.sqrt(vertex_count)))
+    u, v = np.meshgrid(np.linspace(0, 1, side), np.linspace(0, 1, side))
+    u, v = u.ravel(), v.ravel()
+    height = 0.05 * np.sin(u * 8 * math.pi) * np.cos(v * 8 * math.pi)
+    vertices = np.stack((u * 100 - 50, v * 100 - 50, height * 100), axis=1)
+    normals = np.stack((np.zeros_like(u), np.zeros_like(u), np.ones_like(u)), axis=1)
+
+    # both triangles of a cell next to each other and the cells row by row, so every face group is a band of rows
+    corner = (np.arange(side - 1)[:, None] * side + np.arange(side - 1)).ravel()
+    triangles = np.stack((np.stack((corner, corner + 1, corner + side), axis=1),
+                          np.stack((corner + 1, corner + side + 1, corner + side), axis=1)), axis=1).reshape(-1, 3)
+    face_groups = max(1, min(face_groups, len(triangles)))
+    groups = {'Count': int_data(face_groups)}
+    for i, chunk in enumerate(np.array_split(triangles, face_groups)):
+        groups[f'Group{i}'] = {
+            'Material': int_data(i % materials),
+            'Face count': int_data(len(chunk)),
+            'Face vertex chain': chunk.astype('<i4').tobytes(),
+        }
+
+    # one batch entry per vertex, the uv and normal of a batch entry are the vertex' own
+    batch = np.arange(len(vertices), dtype='<i4').tobytes()
+    library = {'Material count': int_data(materials)}
+    for i in range(materials):
+        library[f'Material #{i}'] = material_node(i, textured)
+    return {
+        'Face groups': groups,
+        'Normals': {
+            'Surface normal count': int_data(len(normals)),
+            'Surface normal list': normals.astype('<f4').tobytes(),
+        },
+        'Vertices': {
+            'Object vertex count': int_data(len(vertices)),
+            'Object vertex list': vertices.astype('<f4').tobytes(),
+            'Vertex batch count': int_data(len(vertices)),
+            'Vertex batch list': batch,
+            'Texture batch list': batch,
+            'Vertex normal': batch,
+            'Texture vertex count': int_data(len(vertices)),
+            'Texture vertex list': np.stack((u, v), axis=1).astype('<f4').tobytes(),
+        },
+        'Material library': library,
+    }
+
+
+def part_records(names: List[str], parents: List[str]) -> bytes:
+    records = np.zeros(len(names), dtype=PART_DTYPE)
+    records['parent_name'] = [name.encode("ascii") for name in parents]
+    records['child_name'] = [name.encode("ascii") for name in names]
+    angles = np.linspace(0, math.pi / 4, len(names))
+    records['rotation'][:, 0, 0] = np.cos(angles)
+    records['rotation'][:, 0, 1] = -np.sin(angles)
+    records['rotation'][:, 1, 0] = np.sin(angles)
+    records['rotation'][:, 1, 1] = np.cos(angles)
+    records['rotation'][:, 2, 2] = 1
+    records['origin'][:, 0] = 10
+    records['axis'][:, 2] = 1
+    records['max'] = math.pi
+    return records.tobytes()
+
+
+def write_3db(path: str, vertex_count: int, face_groups: int = 1, materials: int = 1):
+    write_utf(path, {'openFLAME 3D N-mesh': mesh_node(vertex_count, face_groups, materials)})
+
+
+def write_cmp(path: str, parts: int, depth: int = None, vertex_count: int = 1000, face_groups: int = 1,
+              materials: int = 1):
+    # parts - 1 child parts below Root, chained depth levels deep and then fanned out, every part with its own mesh
+    depth = parts - 1 if depth is None else max(1, depth)
+    names = ["Root"] + [f"p{i:05d}" for i in range(1, parts)]
+    parents = [names[i - 1] if i <= depth else names[(i - 1) % depth + 1] for i in range(1, parts)]
+    mesh = mesh_node(vertex_count, face_groups, materials)
+    tree = {'Cmpnd': {
+        'Root': {'File name': b"Root.3db\0", 'Object name': b"Root\0", 'Index': int_data(0)},
+        'Cons': {'Pris': part_records(names[1:], parents)},
+    }}
+    for name in names:
+        tree[f"{name}.3db"] = {'openFLAME 3D N-mesh': mesh}
+    write_utf(path, tree)
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Iterable
+
+from filereader3db import UtfFile, get_as_string
+from obj_generator import texture_maps
+from cache import file_hash
+
+
+def texture_references(source: str) -> List[str]:
+    # colour and bump texture names of every material in the file, only the map name nodes are read
+    utf = UtfFile()
+    index = utf.open_index(source)
+    names = set()
+    for node_path in index:
+        if node_path.endswith("/Diffuse/Map/Name"):
+            maps = texture_maps(get_as_string(utf.get(node_path)))
+            if maps is not None:
+                names.update(maps)
+    return sorted(names)
+
+
+def find_textures(names: Iterable[str], roots: List[str]) -> Dict[str, str]:
+    # one walk over the search roots, names are matched without case as the game files come from Windows. The first
+    # root that has a texture wins
+    wanted = {x.lower() for x in names}
+    found: Dict[str, str] = {}
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                key = filename.lower()
+                if key in wanted and key not in found:
+                    found[key] = os.path.join(dirpath, filename)
+    return found
+
+
+def png_name(name: str) -> str:
+    return os.path.splitext(name)[0] + ".png"
+
+
+def place(source: str, destination: str, link: bool):
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        os.remove(destination)
+    if link:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            # other device or no hard link support, fall back to a copy
+            pass
+    shutil.copy2(source, destination)
+
+
+def convert_to_png(source: str, destination: str):
+    from PIL import Image
+    with Image.open(source) as image:
+        image.save(destination)
+
+
+def place_group(directory: str, names: List[str], source: str, content_hash: str, link: bool, png: bool) -> int:
+    # every name of one texture content ends up in directory, the content is read from the source once and the other
+    # names are copies of the first one, or hard links to it with link
+    first = os.path.join(directory, names[0])
+    if not (os.path.isfile(first) and file_hash(first) == content_hash):
+        place(source, first, link)
+    written = 1
+    for name in names[1:]:
+        place(first, os.path.join(directory, name), link)
+        written += 1
+    if png:
+        first_png = os.path.join(directory, png_name(names[0]))
+        convert_to_png(first, first_png)
+        for name in names[1:]:
+            place(first_png, os.path.join(directory, png_name(name)), link)
+        written += len(names)
+    return written
+
+
+def collect_textures(models: List[Tuple[str, str]], roots: List[str], link: bool = False, png: bool = False,
+                     jobs: int = None) -> Dict:
+    # models are (source model, output directory) pairs, the textures each model references are placed in its output
+    # directory. Returns the placed file count and the missing texture names with the models that use them
+    if png:
+        try:
+            import PIL
+        except ImportError:
+            print("PNG conversion needs Pillow (pip install pillow), the textures are copied as they are")
+            png = False
+
+    needed: Dict[str, set] = {}
+    users: Dict[str, List[str]] = {}
+    spelling: Dict[str, str] = {}
+    for source, directory in models:
+        for name in texture_references(source):
+            needed.setdefault(os.path.abspath(directory or "."), set()).add(name)
+            users.setdefault(name.lower(), []).append(source)
+            spelling.setdefault(name.lower(), name)
+
+    found = find_textures(users, roots)
+    missing = {spelling[name]: users[name] for name in sorted(users) if name not in found}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        hashes = dict(zip(found, executor.map(file_hash, found.values())))
+
+        # names are grouped by content per output directory, so duplicates are copied and converted once
+        groups: Dict[Tuple[str, str], List[str]] = {}
+        for directory, names in needed.items():
+            for name in sorted(names):
+                if name.lower() in found:
+                    groups.setdefault((directory, hashes[name.lower()]), []).append(name)
+        futures = []
+        for (directory, content_hash), names in groups.items():
+            os.makedirs(directory, exist_ok=True)
+            source = found[names[0].lower()]
+            futures.append(executor.submit(place_group, directory, names, source, content_hash, link, png))
+        placed = 0
+        failed = []
+        for (directory, _), future in zip(groups, futures):
+            try:
+                placed += future.result()
+            except Exception as ex:
+                failed.append(f"{directory}: {type(ex).__name__}: {ex}")
+
+    summary = {'referenced': len(users), 'found': len(found), 'unique': len(set(hashes.values())),
+               'placed': placed, 'missing': missing, 'failed': failed}
+    print(f"Textures: {len(users)} referenced, {len(found)} found ({summary['unique']} unique), "
+          f"{placed} files placed, {len(missing)} missing")
+    for name, sources in missing.items():
+        print(f"Missing texture {name}, used by {', '.join(sorted(set(sources)))}")
+    for error in failed:
+        print(f"Failed to place textures in {error}")
+    return summary
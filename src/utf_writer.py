@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from typing import Dict, List, Tuple
+
+from filereader3db import HEADER_STRUCT, NODE_STRUCT
+
+NODE_BLOCK_OFFSET = 56
+
+
+def flatten(tree: Dict) -> List[Tuple[str, object, int]]:
+    # (name, leaf bytes or None, depth) in the pre-order the reader walks the nodes
+    nodes = []
+    stack = [("\\", tree, 0)]
+    while stack:
+        name, value, depth = stack.pop()
+        if isinstance(value, dict):
+            nodes.append((name, None, depth))
+            stack.extend((key, child, depth + 1) for key, child in reversed(list(value.items())))
+        else:
+            nodes.append((name, bytes(value), depth))
+    return nodes
+
+
+def build_utf(tree: Dict) -> bytes:
+    # tree maps node names to bytes like objects for leaves and to dicts for folders, the root node is implicit
+    nodes = flatten(tree)
+
+    strings = bytearray()
+    name_offsets: Dict[str, int] = {}
+    for name, _, _ in nodes:
+        if name not in name_offsets:
+            name_offsets[name] = len(strings)
+            strings += name.encode("ascii") + b"\0"
+
+    data = bytearray()
+    data_offsets = []
+    for _, value, _ in nodes:
+        data_offsets.append(len(data))
+        if value is not None:
+            data += value + b"\0" * (-len(value) % 4)
+
+    # the next node at the same depth before the depth drops below is the peer, the node after a folder its child
+    peers = [0] * len(nodes)
+    last_at_depth: Dict[int, int] = {}
+    for i, (_, _, depth) in enumerate(nodes):
+        if depth in last_at_depth:
+            peers[last_at_depth[depth]] = i * NODE_STRUCT.size
+        last_at_depth[depth] = i
+        for deeper in [x for x in last_at_depth if x > depth]:
+            del last_at_depth[deeper]
+
+    node_block = bytearray()
+    for i, (name, value, depth) in enumerate(nodes):
+        if value is None:
+            has_children = i + 1 < len(nodes) and nodes[i + 1][2] > depth
+            child = (i + 1) * NODE_STRUCT.size if has_children else 0
+            node_block += NODE_STRUCT.pack(peers[i], name_offsets[name], 0x10, 0, child, 0, 0, 0, 0, 0, 0)
+        else:
+            size = len(value)
+            node_block += NODE_STRUCT.pack(peers[i], name_offsets[name], 0x80, 0, data_offsets[i],
+                                           size + (-size % 4), size, size, 0, 0, 0)
+
+    string_block_offset = NODE_BLOCK_OFFSET + len(node_block)
+    data_block_offset = string_block_offset + len(strings)
+    header = HEADER_STRUCT.pack(0x20465455, 0x101, NODE_BLOCK_OFFSET, len(node_block), 0, NODE_STRUCT.size,
+                                string_block_offset, len(strings), data_block_offset)
+    header += b"\0" * (NODE_BLOCK_OFFSET - len(header))
+    return bytes(header + node_block + strings + data)
+
+
+def write_utf(path: str, tree: Dict):
+    with open(path, "wb") as outfile:
+        outfile.write(build_utf(tree))